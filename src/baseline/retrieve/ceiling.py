@@ -20,6 +20,9 @@ def parse_args():
     parser.add_argument("--dataset", type=str, required=True)
     parser.add_argument("--retriever", type=str, required=True)
     parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument(
+        "--result_cache", type=str, default=None, help="SQLite file caching retrieval results across runs"
+    )
     return parser.parse_args()
 
 
@@ -37,6 +40,7 @@ def main(opt: argparse.Namespace):
         passage_embedding_path=embedding_path,
         index_path_dir=embedding_path,
         model_type=opt.retriever,
+        result_cache_path=opt.result_cache,
     )
     dataset = load_jsonl(
         os.path.join(
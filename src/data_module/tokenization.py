@@ -0,0 +1,50 @@
+from typing import Literal
+
+import spacy
+from transformers import PreTrainedTokenizer
+
+LABELER_MAX_LENGTH = 384
+
+Segmentation = Literal["tokenizer", "full"]
+SPACY_COMPONENTS = [
+    "tok2vec",
+    "tagger",
+    "parser",
+    "senter",
+    "attribute_ruler",
+    "lemmatizer",
+    "ner",
+]
+
+
+def load_spacy(segmentation: Segmentation = "tokenizer") -> spacy.Language:
+    if segmentation == "full":
+        return spacy.load("en_core_web_sm")
+    # the pipeline components never change token boundaries, the tokenizer alone
+    # yields the same words as the full pipeline
+    return spacy.load("en_core_web_sm", exclude=SPACY_COMPONENTS)
+
+
+def spacify_batch(
+    texts: list[str],
+    nlp: spacy.Language,
+    ignore_tokens=set([","]),
+    batch_size: int = 256,
+) -> list[list[str]]:
+    # without a lemmatizer the lemma of punctuation is its text
+    use_lemma = "lemmatizer" in nlp.pipe_names
+    words = []
+    for doc in nlp.pipe(texts, batch_size=batch_size):
+        words.append(
+            [
+                word.text
+                for word in doc
+                if (word.lemma_ if use_lemma else word.text) not in ignore_tokens
+            ]
+        )
+    return words
+
+
+def tokenize_words(words: list[str], tokenizer: PreTrainedTokenizer):
+    tokenized_text = sum([tokenizer.tokenize(word) for word in words], [])
+    return tokenized_text
@@ -63,7 +63,9 @@ class LabelerTrainer(Trainer):
         return (loss, outputs) if return_outputs else loss
 
 
-def eval_labeler(pred: EvalPrediction):
+def eval_labeler(pred: EvalPrediction, tag_mapping: dict = None):
+    if tag_mapping is None:
+        tag_mapping = CHUNK_TAG_MAPPING
     tag_prediction = torch.tensor(pred.predictions[0].argmax(-1))
     token_prediction = torch.tensor(pred.predictions[1].argmax(-1))
     tag_label = torch.tensor(pred.label_ids[1])
@@ -84,7 +86,7 @@ def eval_labeler(pred: EvalPrediction):
     }
 
     tag_f1 = f1_score(tag_prediction, tag_label, average=None, zero_division=0)
-    for tag, idx in CHUNK_TAG_MAPPING.items():
+    for tag, idx in tag_mapping.items():
         result[f"tag_f1-{tag.strip('<>')}"] = tag_f1[idx]
     result["tag_f1"] = f1_score(token_prediction, token_label, average="micro")
 
@@ -122,7 +124,10 @@ def build_dataset(
     tokenizer=None,
     test_mode: bool = False,
     test_sample_cnt: int = 100,
+    tag_mapping: dict = None,
 ):
+    if tag_mapping is None:
+        tag_mapping = CHUNK_TAG_MAPPING
     data_path = os.path.join(
         EFFICIENT_RAG_LABELER_TRAINING_DATA_PATH, dataset, f"{split}.jsonl"
     )
@@ -130,7 +135,7 @@ def build_dataset(
     original_question = [d["question"] for d in data]
     chunk_tokens = [d["chunk_tokens"] for d in data]
     chunk_labels = [d["labels"] for d in data]
-    tags = [CHUNK_TAG_MAPPING[d["tag"]] for d in data]
+    tags = [tag_mapping[d["tag"]] for d in data]
 
     if test_mode:
         return LabelerDataset(
@@ -1 +1,10 @@
 from .model import DebertaForSequenceTokenClassification
+from .onnx_model import (
+    FILTER_ONNX_FNAME,
+    FILTER_OUTPUTS,
+    LABELER_ONNX_FNAME,
+    LABELER_OUTPUTS,
+    OnnxModel,
+    load_onnx_models,
+)
+from .quantization import model_size_mb, quantize_int8
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import torch
+
+LABELER_ONNX_FNAME = "labeler.onnx"
+FILTER_ONNX_FNAME = "filter.onnx"
+LABELER_OUTPUTS = ["sequence_logits", "token_logits"]
+FILTER_OUTPUTS = ["logits"]
+
+
+class OnnxModel(object):
+    """ONNX Runtime session behaving like the exported PyTorch model at inference.
+
+    Calling it returns a dict of CPU tensors keyed by the output names, so it
+    can stand in for the labeler or the filter in the retrieval loop.
+    """
+
+    def __init__(self, model_path: str, device: torch.device, num_threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        providers = ["CPUExecutionProvider"]
+        if device.type == "cuda":
+            providers = ["CUDAExecutionProvider"] + providers
+        self.session = ort.InferenceSession(model_path, options, providers=providers)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.output_names = [o.name for o in self.session.get_outputs()]
+        # labels of the sequence head are a static axis of the exported graph
+        if "sequence_logits" in self.output_names:
+            sequence_output = self.session.get_outputs()[self.output_names.index("sequence_logits")]
+            self.sequence_labels = sequence_output.shape[-1]
+
+    @property
+    def device(self) -> torch.device:
+        return torch.device("cpu")
+
+    def eval(self):
+        return self
+
+    def __call__(self, **inputs) -> dict[str, torch.Tensor]:
+        feed = {
+            name: np.ascontiguousarray(inputs[name].cpu().numpy(), dtype=np.int64)
+            for name in self.input_names
+        }
+        outputs = self.session.run(self.output_names, feed)
+        return {name: torch.from_numpy(output) for name, output in zip(self.output_names, outputs)}
+
+
+def load_onnx_models(
+    onnx_dir: str, device: torch.device, num_threads: int = 0
+) -> tuple[OnnxModel, OnnxModel]:
+    labeler = OnnxModel(os.path.join(onnx_dir, LABELER_ONNX_FNAME), device, num_threads)
+    filter = OnnxModel(os.path.join(onnx_dir, FILTER_ONNX_FNAME), device, num_threads)
+    return labeler, filter
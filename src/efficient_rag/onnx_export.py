@@ -0,0 +1,138 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import torch
+import torch.nn as nn
+from transformers import DebertaV2ForTokenClassification, PreTrainedModel
+
+from efficient_rag.model import (
+    FILTER_ONNX_FNAME,
+    FILTER_OUTPUTS,
+    LABELER_ONNX_FNAME,
+    LABELER_OUTPUTS,
+    DebertaForSequenceTokenClassification,
+    OnnxModel,
+)
+
+INPUT_NAMES = ["input_ids", "attention_mask"]
+
+
+class LabelerExportWrapper(nn.Module):
+    def __init__(self, model: DebertaForSequenceTokenClassification):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask)
+        return outputs.sequence_logits, outputs.token_logits
+
+
+class FilterExportWrapper(nn.Module):
+    def __init__(self, model: DebertaV2ForTokenClassification):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask)
+        return outputs.logits
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export EfficientRAG labeler and filter to ONNX")
+    parser.add_argument("--labels", type=int, default=2)
+    parser.add_argument("--labeler_ckpt", type=str, required=True)
+    parser.add_argument("--filter_ckpt", type=str, required=True)
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--opset", type=int, default=14)
+    parser.add_argument("--check", action="store_true", help="compare ONNX Runtime with PyTorch")
+    parser.add_argument("--check_samples", type=int, default=64)
+    parser.add_argument("--check_max_length", type=int, default=384)
+    parser.add_argument("--tolerance", type=float, default=0.99, help="min agreement rate")
+    args = parser.parse_args()
+    return args
+
+
+def dummy_inputs(vocab_size: int, batch_size: int, max_length: int, seed: int = 0) -> dict:
+    generator = torch.Generator().manual_seed(seed)
+    lengths = torch.randint(4, max_length + 1, (batch_size,), generator=generator)
+    input_ids = torch.randint(5, vocab_size, (batch_size, max_length), generator=generator)
+    attention_mask = (torch.arange(max_length)[None, :] < lengths[:, None]).long()
+    input_ids = input_ids * attention_mask
+    return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+def export(model: nn.Module, output_names: list[str], output_path: str, opset: int):
+    inputs = dummy_inputs(model.model.config.vocab_size, 2, 16)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in INPUT_NAMES}
+    for name in output_names:
+        dynamic_axes[name] = {0: "batch"} if name == "sequence_logits" else {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        model,
+        (inputs["input_ids"], inputs["attention_mask"]),
+        output_path,
+        input_names=INPUT_NAMES,
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+    )
+    print(f"Export model to {output_path}")
+
+
+def check_parity(
+    model: PreTrainedModel,
+    onnx_model: OnnxModel,
+    output_names: list[str],
+    samples: int,
+    max_length: int,
+) -> dict[str, float]:
+    """Agreement of argmax predictions between PyTorch and ONNX Runtime, padding excluded."""
+    inputs = dummy_inputs(model.config.vocab_size, samples, max_length, seed=42)
+    with torch.inference_mode():
+        torch_outputs = model(**inputs)
+    onnx_outputs = onnx_model(**inputs)
+    mask = inputs["attention_mask"].bool()
+    result = {}
+    for name in output_names:
+        torch_pred = torch_outputs[name].argmax(-1)
+        onnx_pred = onnx_outputs[name].argmax(-1)
+        if torch_pred.dim() == 2:
+            torch_pred = torch_pred[mask]
+            onnx_pred = onnx_pred[mask]
+        result[name] = (torch_pred == onnx_pred).float().mean().item()
+    return result
+
+
+def main(opt: argparse.Namespace):
+    if not os.path.isdir(opt.output_dir):
+        os.makedirs(opt.output_dir)
+    labeler = DebertaForSequenceTokenClassification.from_pretrained(
+        opt.labeler_ckpt, token_labels=2, sequence_labels=opt.labels
+    ).eval()
+    filter = DebertaV2ForTokenClassification.from_pretrained(opt.filter_ckpt, num_labels=2).eval()
+    labeler_path = os.path.join(opt.output_dir, LABELER_ONNX_FNAME)
+    filter_path = os.path.join(opt.output_dir, FILTER_ONNX_FNAME)
+    export(LabelerExportWrapper(labeler), LABELER_OUTPUTS, labeler_path, opt.opset)
+    export(FilterExportWrapper(filter), FILTER_OUTPUTS, filter_path, opt.opset)
+
+    if not opt.check:
+        return
+    passed = True
+    for name, model, path, output_names in (
+        ("labeler", labeler, labeler_path, LABELER_OUTPUTS),
+        ("filter", filter, filter_path, FILTER_OUTPUTS),
+    ):
+        onnx_model = OnnxModel(path, torch.device("cpu"))
+        agreement = check_parity(model, onnx_model, output_names, opt.check_samples, opt.check_max_length)
+        for output_name, rate in agreement.items():
+            print(f"{name} {output_name} argmax agreement: {rate:.4f}")
+            passed = passed and rate >= opt.tolerance
+    if not passed:
+        raise SystemExit(f"ONNX parity check failed, agreement below {opt.tolerance}")
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    main(options)
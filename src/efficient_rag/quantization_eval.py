@@ -0,0 +1,144 @@
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+from transformers import (
+    DebertaV2ForTokenClassification,
+    DebertaV2Tokenizer,
+    EvalPrediction,
+    PreTrainedModel,
+)
+
+from conf import MODEL_PATH, TAG_MAPPING, TAG_MAPPING_TWO
+from efficient_rag.filter_training import build_dataset as build_filter_dataset
+from efficient_rag.filter_training import eval_filter
+from efficient_rag.labeler_training import build_dataset as build_labeler_dataset
+from efficient_rag.labeler_training import eval_labeler
+from efficient_rag.model import (
+    DebertaForSequenceTokenClassification,
+    model_size_mb,
+    quantize_int8,
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Accuracy of int8 quantized labeler and filter")
+    parser.add_argument("--dataset", required=True, type=str)
+    parser.add_argument("--labels", type=int, default=2, choices=[2, 3])
+    parser.add_argument("--labeler_ckpt", type=str, required=True)
+    parser.add_argument("--filter_ckpt", type=str, required=True)
+    parser.add_argument("--labeler_max_length", type=int, default=384)
+    parser.add_argument("--filter_max_length", type=int, default=128)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--num_threads", type=int, default=0)
+    parser.add_argument("--max_samples", type=int, default=None)
+    parser.add_argument("--output", type=str, default=None, help="json report path")
+    args = parser.parse_args()
+    return args
+
+
+def predict(
+    model: PreTrainedModel,
+    dataset: Dataset,
+    output_keys: list[str],
+    label_keys: list[str],
+    batch_size: int,
+) -> tuple[EvalPrediction, float]:
+    """Collect predictions in the layout Trainer hands to compute_metrics."""
+    predictions = {k: [] for k in output_keys}
+    labels = {k: [] for k in label_keys}
+    inputs = []
+    start = time.time()
+    with torch.inference_mode():
+        for batch in tqdm(DataLoader(dataset, batch_size=batch_size), desc="Predicting"):
+            outputs = model(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"])
+            for k in output_keys:
+                predictions[k].append(outputs[k].float().numpy())
+            for k in label_keys:
+                labels[k].append(batch[k].numpy())
+            inputs.append(batch["input_ids"].numpy())
+    elapsed = time.time() - start
+    predictions = tuple(np.concatenate(predictions[k]) for k in output_keys)
+    labels = tuple(np.concatenate(labels[k]) for k in label_keys)
+    pred = EvalPrediction(
+        predictions=predictions if len(predictions) > 1 else predictions[0],
+        label_ids=labels if len(labels) > 1 else labels[0],
+        inputs=np.concatenate(inputs),
+    )
+    return pred, elapsed
+
+
+def evaluate(model, dataset, output_keys, label_keys, metric_fn, batch_size) -> dict:
+    pred, elapsed = predict(model, dataset, output_keys, label_keys, batch_size)
+    result = {k: float(v) for k, v in metric_fn(pred).items()}
+    result["size_mb"] = model_size_mb(model)
+    result["seconds"] = elapsed
+    return result
+
+
+def compare(name: str, fp32: dict, int8: dict) -> dict:
+    print(f"{name:<32}{'fp32':>10}{'int8':>10}{'delta':>10}")
+    for k in fp32:
+        print(f"{k:<32}{fp32[k]:>10.4f}{int8[k]:>10.4f}{int8[k] - fp32[k]:>10.4f}")
+    return {"fp32": fp32, "int8": int8}
+
+
+def main(opt: argparse.Namespace):
+    if opt.num_threads > 0:
+        torch.set_num_threads(opt.num_threads)
+    tag_mapping = TAG_MAPPING_TWO if opt.labels == 2 else TAG_MAPPING
+    tokenizer = DebertaV2Tokenizer.from_pretrained(MODEL_PATH)
+    test_mode = opt.max_samples is not None
+    report = {}
+
+    labeler_dataset = build_labeler_dataset(
+        opt.dataset,
+        "valid",
+        opt.labeler_max_length,
+        tokenizer,
+        test_mode=test_mode,
+        test_sample_cnt=opt.max_samples,
+        tag_mapping=tag_mapping,
+    )
+    labeler = DebertaForSequenceTokenClassification.from_pretrained(
+        opt.labeler_ckpt, token_labels=2, sequence_labels=opt.labels
+    ).eval()
+    labeler_args = (
+        ["sequence_logits", "token_logits"],
+        ["token_labels", "sequence_labels"],
+        functools.partial(eval_labeler, tag_mapping=tag_mapping),
+        opt.batch_size,
+    )
+    labeler_fp32 = evaluate(labeler, labeler_dataset, *labeler_args)
+    labeler_int8 = evaluate(quantize_int8(labeler), labeler_dataset, *labeler_args)
+    report["labeler"] = compare("labeler", labeler_fp32, labeler_int8)
+    del labeler
+
+    filter_dataset = build_filter_dataset(opt.dataset, "valid", opt.filter_max_length, tokenizer)
+    if test_mode:
+        filter_dataset.texts = filter_dataset.texts[: opt.max_samples]
+        filter_dataset.labels = filter_dataset.labels[: opt.max_samples]
+    filter = DebertaV2ForTokenClassification.from_pretrained(opt.filter_ckpt, num_labels=2).eval()
+    filter_args = (["logits"], ["labels"], eval_filter, opt.batch_size)
+    filter_fp32 = evaluate(filter, filter_dataset, *filter_args)
+    filter_int8 = evaluate(quantize_int8(filter), filter_dataset, *filter_args)
+    report["filter"] = compare("filter", filter_fp32, filter_int8)
+
+    if opt.output is not None:
+        with open(opt.output, "w+", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Save quantization report to {opt.output}")
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    main(options)
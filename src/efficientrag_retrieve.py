@@ -2,9 +2,12 @@ import argparse
 import json
 import os
 import sys
-from typing import Iterator
+from collections import OrderedDict
+from typing import Iterator, Literal, Optional
 
+import numpy as np
 import spacy
+import torch
 from tqdm.rich import tqdm_rich
 from transformers import (
     DebertaV2ForTokenClassification,
@@ -29,223 +32,672 @@ from conf import (
     TERMINATE_TAG,
 )
 from data_module.format import build_query_info_sentence
-from efficient_rag.model import DebertaForSequenceTokenClassification
+from data_module.tokenization import (
+    LABELER_MAX_LENGTH,
+    Segmentation,
+    load_spacy,
+    spacify_batch,
+    tokenize_words,
+)
+from efficient_rag.model import (
+    DebertaForSequenceTokenClassification,
+    load_onnx_models,
+    quantize_int8,
+)
 from retrievers import Retriever
+from retrievers.embeddings.utils.device import (
+    inference_context,
+    resolve_device,
+    set_num_threads,
+)
+from retrievers.token_store import PassageTokenStore
 from utils import load_jsonl, write_jsonl
 
 MAX_ITER = 4
-LABELER_MAX_LENGTH = 384
 FILTER_MAX_LENGTH = 128
 
+Padding = Literal["longest", "max_length"]
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset", type=str, required=True)
     parser.add_argument("--retriever", type=str, required=True)
     parser.add_argument("--labels", type=int, default=2)
-    parser.add_argument("--labeler_ckpt", type=str, required=True)
-    parser.add_argument("--filter_ckpt", type=str, required=True)
+    parser.add_argument("--labeler_ckpt", type=str, default=None)
+    parser.add_argument("--filter_ckpt", type=str, default=None)
+    parser.add_argument(
+        "--backend", type=str, default="torch", choices=["torch", "onnx"]
+    )
+    parser.add_argument(
+        "--onnx_dir",
+        type=str,
+        default=None,
+        help="labeler.onnx and filter.onnx from efficient_rag/onnx_export.py",
+    )
+    parser.add_argument(
+        "--quantize",
+        type=str,
+        default="none",
+        choices=["none", "int8"],
+        help="int8: dynamic quantization of linear layers, runs on CPU",
+    )
     parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument(
+        "--hop_topk",
+        type=int,
+        nargs="+",
+        default=None,
+        help="retrieved chunks per hop, the last value is kept for later hops",
+    )
+    parser.add_argument(
+        "--min_score",
+        type=float,
+        default=None,
+        help="do not label chunks with a retriever score below this",
+    )
+    parser.add_argument(
+        "--score_gap",
+        type=float,
+        default=None,
+        help="do not label chunks scoring more than this below the best chunk",
+    )
+    parser.add_argument(
+        "--adaptive_hop_k",
+        action="store_true",
+        help="retrieve at most as many chunks as survived pruning in the previous hop",
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=32, help="questions advanced per hop"
+    )
+    parser.add_argument(
+        "--forward_batch_size",
+        type=int,
+        default=64,
+        help="max sequences per labeler / filter forward",
+    )
+    parser.add_argument(
+        "--padding",
+        type=str,
+        default="longest",
+        choices=["longest", "max_length"],
+        help="longest: bucket by length and pad per batch",
+    )
+    parser.add_argument(
+        "--segmentation",
+        type=str,
+        default="tokenizer",
+        choices=["tokenizer", "full"],
+        help="tokenizer: word segmentation with the spaCy tokenizer only",
+    )
+    parser.add_argument(
+        "--token_store",
+        type=str,
+        default=None,
+        help="passage token ids from retrievers/passage_tokenizer.py, "
+        "defaults to data/corpus/<dataset>/deberta_tokens if present",
+    )
+    parser.add_argument(
+        "--labeler_cache_size",
+        type=int,
+        default=100000,
+        help="max cached (query, passage) labeler results, 0 to disable",
+    )
+    parser.add_argument(
+        "--query_cache_size",
+        type=int,
+        default=10000,
+        help="max cached query embeddings in the retriever, 0 to disable",
+    )
+    parser.add_argument(
+        "--result_cache",
+        type=str,
+        default=None,
+        help="SQLite file caching retrieval results across runs",
+    )
+    parser.add_argument(
+        "--exclude_seen",
+        action="store_true",
+        help="do not retrieve passages already labeled in earlier hops",
+    )
+    parser.add_argument("--device", type=str, default="auto", help="auto, cpu or cuda")
+    parser.add_argument(
+        "--num_threads", type=int, default=0, help="torch CPU threads, 0 for default"
+    )
+    parser.add_argument(
+        "--bf16", action="store_true", help="bf16 autocast on CPUs that support it"
+    )
     parser.add_argument("--suffix", type=str, default="")
     parser.add_argument("--test", action="store_true")
-    return parser.parse_args()
-
-
-def spacify(
-    text: str, nlp: spacy.Language = None, ignore_tokens=set([","])
-) -> list[str]:
-    if nlp is None:
-        nlp = spacy.load("en_core_web_sm")
-    doc = nlp(text)
-    words = []
-    for word in doc:
-        if word.lemma_ not in ignore_tokens:
-            words.append(word.text)
-    return words
-
-
-def tokenize_words(words: list[str], tokenizer: PreTrainedTokenizer):
-    tokenized_text = sum([tokenizer.tokenize(word) for word in words], [])
-    return tokenized_text
+    args = parser.parse_args()
+    if args.backend == "torch" and (args.labeler_ckpt is None or args.filter_ckpt is None):
+        parser.error("--labeler_ckpt and --filter_ckpt are required for the torch backend")
+    if args.backend == "onnx" and args.quantize != "none":
+        parser.error("--quantize only applies to the torch backend")
+    if args.backend == "onnx" and args.onnx_dir is None:
+        parser.error("--onnx_dir is required for the onnx backend")
+    return args
 
 
-def build_labeler_input(
-    query: str,
+def encode_labeler_pairs(
+    queries: list[str],
     chunks: list[str],
     tokenizer: PreTrainedTokenizer,
     nlp: spacy.Language,
-):
-    # construct inpus
-    query_tokens = spacify(query, nlp)
-    chunk_tokens = [spacify(chunk, nlp) for chunk in chunks]
-    query_chunk_tokens = [
-        [CLS_TOKEN] + query_tokens + [SEP_TOKEN] + chunk_token + [SEP_TOKEN]
-        for chunk_token in chunk_tokens
-    ]
+    chunk_ids: list[str] = None,
+    token_store: PassageTokenStore = None,
+) -> list[list[int]]:
+    # chunks found in the token store are sliced out of it, the rest are
+    # spacified together with the distinct queries of this batch
+    chunk_token_ids = [None] * len(chunks)
+    if token_store is not None and chunk_ids is not None:
+        for idx, chunk_id in enumerate(chunk_ids):
+            if chunk_id in token_store:
+                chunk_token_ids[idx] = token_store.get(chunk_id).tolist()
+    missing = [idx for idx, ids in enumerate(chunk_token_ids) if ids is None]
+
+    unique_queries = list(set(queries))
+    words = spacify_batch(unique_queries + [chunks[idx] for idx in missing], nlp)
     # from spacy to tokenizer
-    query_chunk_tokens = [
-        tokenize_words(query_chunk_token, tokenizer)
-        for query_chunk_token in query_chunk_tokens
-    ]
-    # max length truncation
-    query_chunk_tokens = [
-        query_chunk_token[:LABELER_MAX_LENGTH]
-        for query_chunk_token in query_chunk_tokens
+    word_ids = [
+        tokenizer.convert_tokens_to_ids(tokenize_words(word, tokenizer))
+        for word in words
     ]
+    query_token_ids = dict(zip(unique_queries, word_ids[: len(unique_queries)]))
+    for idx, ids in zip(missing, word_ids[len(unique_queries) :]):
+        chunk_token_ids[idx] = ids
+
+    # [CLS] query [SEP] chunk [SEP] with max length truncation
+    cls_id, sep_id = tokenizer.cls_token_id, tokenizer.sep_token_id
     input_ids = [
-        tokenizer.convert_tokens_to_ids(query_chunk_token)
-        for query_chunk_token in query_chunk_tokens
+        ([cls_id] + query_token_ids[query] + [sep_id] + ids + [sep_id])[
+            :LABELER_MAX_LENGTH
+        ]
+        for query, ids in zip(queries, chunk_token_ids)
     ]
-    input_ids = {"input_ids": input_ids}
-    tokenized = tokenizer.pad(
-        input_ids,
-        max_length=LABELER_MAX_LENGTH,
-        return_attention_mask=True,
-        padding="max_length",
-        return_tensors="pt",
-    )
-    return tokenized
+    return input_ids
 
 
-def build_filter_input(
-    query_info: str, tokenizer: PreTrainedTokenizer, nlp: spacy.Language = None
-):
+def encode_filter_inputs(
+    query_infos: list[str],
+    tokenizer: PreTrainedTokenizer,
+    nlp: spacy.Language = None,
+) -> list[list[int]]:
     if nlp is None:
-        nlp = spacy.load("en_core_web_sm")
-    query_info = [CLS_TOKEN] + spacify(query_info, nlp) + [SEP_TOKEN]
-    query_info = tokenize_words(query_info, tokenizer)
-    input_ids = tokenizer.convert_tokens_to_ids(query_info)
-    input_ids = input_ids[:FILTER_MAX_LENGTH]
-    input_ids = {"input_ids": [input_ids]}
-    tokenized = tokenizer.pad(
-        input_ids,
-        max_length=FILTER_MAX_LENGTH,
-        return_attention_mask=True,
-        padding="max_length",
-        return_tensors="pt",
-    )
-    return tokenized
+        nlp = load_spacy()
+    input_ids = []
+    for query_info in spacify_batch(query_infos, nlp):
+        query_info = [CLS_TOKEN] + query_info + [SEP_TOKEN]
+        query_info = tokenize_words(query_info, tokenizer)
+        ids = tokenizer.convert_tokens_to_ids(query_info)
+        input_ids.append(ids[:FILTER_MAX_LENGTH])
+    return input_ids
+
+
+def length_buckets(lengths: list[int], batch_size: int) -> list[list[int]]:
+    """Group sequence indices of similar length, shortest first."""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def predict_in_buckets(
+    model: PreTrainedModel,
+    tokenizer: PreTrainedTokenizer,
+    input_ids: list[list[int]],
+    batch_size: int,
+    max_length: int,
+    padding: Padding = "longest",
+    token_output: str = "logits",
+    sequence_output: str = None,
+) -> tuple[list[np.ndarray], Optional[np.ndarray]]:
+    """Run the model over unpadded sequences and return the selected token ids.
+
+    With ``padding="longest"`` sequences are bucketed by length and each bucket
+    is only padded to its longest member; ``"max_length"`` keeps the input
+    order and pads every batch to ``max_length``. The argmax and the masking of
+    ``input_ids`` happen on the model device, only the ids of tokens labeled 1
+    and the sequence tags are copied back, in the original order.
+    """
+    if padding == "longest":
+        buckets = length_buckets([len(ids) for ids in input_ids], batch_size)
+    else:
+        indexes = list(range(len(input_ids)))
+        buckets = [
+            indexes[i : i + batch_size] for i in range(0, len(indexes), batch_size)
+        ]
+
+    selected_ids = [None] * len(input_ids)
+    sequence_tags = None
+    if sequence_output is not None:
+        sequence_tags = np.zeros(len(input_ids), dtype=np.int64)
+    device = model.device
+    with torch.no_grad():
+        for bucket in buckets:
+            batch = tokenizer.pad(
+                {"input_ids": [input_ids[i] for i in bucket]},
+                max_length=max_length,
+                return_attention_mask=True,
+                padding=padding,
+                return_tensors="pt",
+            )
+            batch = {k: v.to(device) for k, v in batch.items()}
+            batch_output = model(**batch)
+            token_mask = batch_output[token_output].argmax(-1) == 1
+            token_mask &= batch["attention_mask"].bool()
+            ids = batch["input_ids"][token_mask].cpu().numpy()
+            counts = token_mask.sum(-1).cpu().numpy()
+            for idx, row_ids in zip(bucket, np.split(ids, np.cumsum(counts)[:-1])):
+                selected_ids[idx] = row_ids
+            if sequence_output is not None:
+                tags = batch_output[sequence_output].argmax(-1).cpu().numpy()
+                sequence_tags[bucket] = tags
+    return selected_ids, sequence_tags
+
+
+class LabelerCache(object):
+    """Bounded LRU cache of labeler results keyed by (query, passage id)."""
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
+    @staticmethod
+    def key(query: str, passage_id: str) -> tuple[str, str]:
+        return " ".join(query.split()), passage_id
 
-def label_info(
+    def get(self, key: tuple[str, str]) -> Optional[tuple[str, str]]:
+        if key not in self.data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.data.move_to_end(key)
+        return self.data[key]
+
+    def put(self, key: tuple[str, str], value: tuple[str, str]):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.data),
+        }
+
+
+def label_pairs(
     labeler: PreTrainedModel,
     tokenizer: PreTrainedTokenizer,
     nlp: spacy.Language,
-    query: str,
+    queries: list[str],
     chunks: list[str],
-):
-    tokenized = build_labeler_input(query, chunks, tokenizer, nlp)
-    tokenized_cuda = {k: v.cuda() for k, v in tokenized.items()}
-    outputs_cuda = labeler(**tokenized_cuda)
-    outputs = {k: v.cpu().detach().numpy() for k, v in outputs_cuda.items()}
-    sequence_logits = outputs["sequence_logits"].argmax(-1)
-    token_logits = outputs["token_logits"].argmax(-1)
-
-    labeled_tokens = [
-        tokenized["input_ids"][i][token_logits[i] == 1]
-        for i in range(len(token_logits))
-    ]
+    batch_size: int = 64,
+    padding: Padding = "longest",
+    chunk_ids: list[str] = None,
+    token_store: PassageTokenStore = None,
+    cache: LabelerCache = None,
+) -> tuple[list[str], list[str]]:
+    """Label every (query, chunk) pair, the i-th chunk is labeled against the i-th query."""
+    if len(chunks) == 0:
+        return [], []
+    if cache is not None and chunk_ids is not None:
+        return label_pairs_cached(
+            labeler,
+            tokenizer,
+            nlp,
+            queries,
+            chunks,
+            chunk_ids,
+            cache,
+            batch_size=batch_size,
+            padding=padding,
+            token_store=token_store,
+        )
+    input_ids = encode_labeler_pairs(
+        queries, chunks, tokenizer, nlp, chunk_ids, token_store
+    )
+    labeled_tokens, sequence_tags = predict_in_buckets(
+        labeler,
+        tokenizer,
+        input_ids,
+        batch_size,
+        LABELER_MAX_LENGTH,
+        padding,
+        token_output="token_logits",
+        sequence_output="sequence_logits",
+    )
     infos = tokenizer.batch_decode(labeled_tokens, skip_special_tokens=True)
     if labeler.sequence_labels == 2:
         tag_mapping_rev = TAG_MAPPING_TWO_REV
     elif labeler.sequence_labels == 3:
         tag_mapping_rev = TAG_MAPPING_REV
-    labels = [tag_mapping_rev[label] for label in sequence_logits]
+    labels = [tag_mapping_rev[label] for label in sequence_tags]
+    return infos, labels
+
+
+def label_pairs_cached(
+    labeler: PreTrainedModel,
+    tokenizer: PreTrainedTokenizer,
+    nlp: spacy.Language,
+    queries: list[str],
+    chunks: list[str],
+    chunk_ids: list[str],
+    cache: LabelerCache,
+    batch_size: int = 64,
+    padding: Padding = "longest",
+    token_store: PassageTokenStore = None,
+) -> tuple[list[str], list[str]]:
+    infos = [None] * len(chunks)
+    labels = [None] * len(chunks)
+    # pairs repeated inside the batch are only labeled once
+    pending = OrderedDict()
+    for idx, (query, chunk_id) in enumerate(zip(queries, chunk_ids)):
+        key = cache.key(query, chunk_id)
+        if key in pending:
+            cache.hits += 1
+            pending[key].append(idx)
+            continue
+        cached = cache.get(key)
+        if cached is None:
+            pending[key] = [idx]
+        else:
+            infos[idx], labels[idx] = cached
+
+    first = [indexes[0] for indexes in pending.values()]
+    new_infos, new_labels = label_pairs(
+        labeler,
+        tokenizer,
+        nlp,
+        [queries[idx] for idx in first],
+        [chunks[idx] for idx in first],
+        batch_size=batch_size,
+        padding=padding,
+        chunk_ids=[chunk_ids[idx] for idx in first],
+        token_store=token_store,
+    )
+    for (key, indexes), info, label in zip(pending.items(), new_infos, new_labels):
+        cache.put(key, (info, label))
+        for idx in indexes:
+            infos[idx] = info
+            labels[idx] = label
     return infos, labels
 
 
-def filter_query(
+def filter_queries(
     filter: PreTrainedModel,
     tokenizer: PreTrainedTokenizer,
     nlp: spacy.Language,
-    prev_query: str,
-    info_list: list[str],
-) -> tuple[str, str]:
-    info_list = [info for info in info_list if len(info.strip()) > 0]
-    sentence = build_query_info_sentence(info_list, prev_query)
-    tokenized = build_filter_input(sentence, tokenizer, nlp)
-    tokenized_cuda = {k: v.cuda() for k, v in tokenized.items()}
-    output_cuda = filter(**tokenized_cuda)
-    output = {k: v.cpu().detach().numpy() for k, v in output_cuda.items()}
-    token_logit = output["logits"].argmax(-1)
-    filtered_ids = tokenized["input_ids"][token_logit == 1]
-    filtered_query = tokenizer.decode(filtered_ids, skip_special_tokens=True)
-    return sentence, filtered_query
+    prev_queries: list[str],
+    info_lists: list[list[str]],
+    batch_size: int = 64,
+    padding: Padding = "longest",
+) -> tuple[list[str], list[str]]:
+    sentences = []
+    for prev_query, info_list in zip(prev_queries, info_lists):
+        info_list = [info for info in info_list if len(info.strip()) > 0]
+        sentences.append(build_query_info_sentence(info_list, prev_query))
+    if len(sentences) == 0:
+        return [], []
+    input_ids = encode_filter_inputs(sentences, tokenizer, nlp)
+    filtered_ids, _ = predict_in_buckets(
+        filter, tokenizer, input_ids, batch_size, FILTER_MAX_LENGTH, padding
+    )
+    filtered_queries = tokenizer.batch_decode(filtered_ids, skip_special_tokens=True)
+    return sentences, filtered_queries
 
 
-def efficient_rag(
+def init_sample_chunks(sample: dict) -> dict:
+    return {
+        "query": sample["question"],
+        "answer": sample["answer"],
+        "oracle": [
+            f"{sample['id']}-{'{:02d}'.format(chunk['positive_paragraph_idx'])}"
+            for chunk in sample["decomposed_questions"].values()
+        ],
+        "oracle_docs": [
+            chunk["positive_paragraph"]
+            for chunk in sample["decomposed_questions"].values()
+        ],
+    }
+
+
+def prune_chunks(
+    chunks: list[dict],
+    scores: list[float],
+    min_score: float = None,
+    score_gap: float = None,
+) -> tuple[list[dict], list[float]]:
+    """Drop weak chunks before labeling, the best chunk is always kept."""
+    if not chunks:
+        return chunks, scores
+    best = max(scores)
+    keep = [
+        j
+        for j, score in enumerate(scores)
+        if score == best
+        or (
+            (min_score is None or score >= min_score)
+            and (score_gap is None or score >= best - score_gap)
+        )
+    ]
+    return [chunks[j] for j in keep], [scores[j] for j in keep]
+
+
+def hop_k(top_k: int, hop_top_k: list[int], iter: int) -> int:
+    if not hop_top_k:
+        return top_k
+    return hop_top_k[min(iter, len(hop_top_k) - 1)]
+
+
+def efficient_rag_batch(
     labeler: PreTrainedModel,
     filter: PreTrainedModel,
     retriever: Retriever,
     tokenizer: PreTrainedTokenizer,
-    dataset: list[dict],
+    nlp: spacy.Language,
+    samples: list[dict],
     top_k: int = 10,
-) -> Iterator[dict]:
-    nlp = spacy.load("en_core_web_sm")
-    for sample in tqdm_rich(dataset):
-    # for sample in dataset:
-        iter = 0
-        filter_input = ""
-        query = sample["question"]
-        sample_chunks = {
-            "query": query,
-            "answer": sample["answer"],
-            "oracle": [
-                f"{sample['id']}-{'{:02d}'.format(chunk['positive_paragraph_idx'])}"
-                for chunk in sample["decomposed_questions"].values()
-            ],
-            "oracle_docs": [
-                chunk["positive_paragraph"]
-                for chunk in sample["decomposed_questions"].values()
-            ],
-        }
-        while iter < MAX_ITER:
-            next_query_info = []
-            chunks = retriever.search(query, top_k=top_k)[0]
-            chunk_texts = [chunk["text"] for chunk in chunks]
-            infos, labels = label_info(labeler, tokenizer, nlp, query, chunk_texts)
-            sample_chunks[iter] = {
-                "query": query,
-                "filter_input": filter_input,
+    forward_batch_size: int = 64,
+    padding: Padding = "longest",
+    token_store: PassageTokenStore = None,
+    labeler_cache: LabelerCache = None,
+    exclude_seen: bool = False,
+    hop_top_k: list[int] = None,
+    min_score: float = None,
+    score_gap: float = None,
+    adaptive_hop_k: bool = False,
+) -> list[dict]:
+    """Advance all samples through the hops in lockstep.
+
+    Every hop issues one retriever search over the live queries, one labeler
+    pass over all (query, chunk) pairs and one filter pass over the queries
+    that continue. Samples leave the batch as soon as they terminate. With
+    ``exclude_seen`` later hops only retrieve passages the sample has not
+    labeled yet. ``hop_top_k`` sets the chunks retrieved per hop, and chunks
+    under ``min_score`` or more than ``score_gap`` below the best chunk of
+    their query are not labeled. With ``adaptive_hop_k`` the next hop of a
+    sample retrieves no more chunks than survived pruning in its last hop,
+    a query whose scores drop off sharply needs fewer candidates.
+    """
+    results = [init_sample_chunks(sample) for sample in samples]
+    queries = [sample["question"] for sample in samples]
+    filter_inputs = [""] * len(samples)
+    seen = [set() for _ in samples]
+    live = list(range(len(samples)))
+    ks = [hop_k(top_k, hop_top_k, 0)] * len(samples)
+    iter = 0
+    while iter < MAX_ITER and len(live) > 0:
+        chunk_lists, score_lists = retriever.search(
+            [queries[i] for i in live],
+            top_k=max(ks[i] for i in live),
+            exclude_ids=[seen[i] for i in live] if exclude_seen else None,
+            return_scores=True,
+        )
+        chunk_lists = [chunks[: ks[i]] for i, chunks in zip(live, chunk_lists)]
+        score_lists = [scores[: ks[i]] for i, scores in zip(live, score_lists)]
+        if min_score is not None or score_gap is not None:
+            pruned = [
+                prune_chunks(chunks, scores, min_score, score_gap)
+                for chunks, scores in zip(chunk_lists, score_lists)
+            ]
+            chunk_lists = [chunks for chunks, _ in pruned]
+            score_lists = [scores for _, scores in pruned]
+        next_k = hop_k(top_k, hop_top_k, iter + 1)
+        for i, chunks in zip(live, chunk_lists):
+            ks[i] = min(next_k, max(len(chunks), 1)) if adaptive_hop_k else next_k
+        pair_queries = [
+            queries[i] for i, chunks in zip(live, chunk_lists) for _ in chunks
+        ]
+        pair_texts = [chunk["text"] for chunks in chunk_lists for chunk in chunks]
+        pair_ids = [chunk["id"] for chunks in chunk_lists for chunk in chunks]
+        infos, labels = label_pairs(
+            labeler,
+            tokenizer,
+            nlp,
+            pair_queries,
+            pair_texts,
+            batch_size=forward_batch_size,
+            padding=padding,
+            chunk_ids=pair_ids,
+            token_store=token_store,
+            cache=labeler_cache,
+        )
+
+        next_live = []
+        next_query_infos = []
+        offset = 0
+        for i, chunks, scores in zip(live, chunk_lists, score_lists):
+            results[i][iter] = {
+                "query": queries[i],
+                "filter_input": filter_inputs[i],
                 "docs": [],
             }
-            for chunk_info, label, chunk in zip(infos, labels, chunks):
+            next_query_info = []
+            for chunk_info, label, chunk, score in zip(
+                infos[offset : offset + len(chunks)],
+                labels[offset : offset + len(chunks)],
+                chunks,
+                scores,
+            ):
                 sample_chunk = {
                     "id": chunk["id"],
                     "title": chunk["title"],
                     "text": chunk["text"],
+                    "score": score,
                     "label": label,
                     "info": chunk_info,
                 }
-                sample_chunks[iter]["docs"].append(sample_chunk)
+                results[i][iter]["docs"].append(sample_chunk)
 
                 if label == CONTINUE_TAG:
                     next_query_info.append(chunk_info)
                 elif label in (TERMINATE_TAG, FINISH_TAG):
                     continue
+            offset += len(chunks)
+            seen[i].update(chunk["id"] for chunk in chunks)
+            if len(next_query_info) > 0:
+                next_live.append(i)
+                next_query_infos.append(next_query_info)
 
-            if len(next_query_info) == 0:
-                break
-            filter_input, query = filter_query(
-                filter, tokenizer, nlp, query, next_query_info
+        if len(next_live) == 0:
+            break
+        sentences, filtered_queries = filter_queries(
+            filter,
+            tokenizer,
+            nlp,
+            [queries[i] for i in next_live],
+            next_query_infos,
+            batch_size=forward_batch_size,
+            padding=padding,
+        )
+        for i, sentence, filtered_query in zip(next_live, sentences, filtered_queries):
+            filter_inputs[i] = sentence
+            queries[i] = filtered_query
+        live = next_live
+        iter += 1
+    return results
+
+
+def efficient_rag(
+    labeler: PreTrainedModel,
+    filter: PreTrainedModel,
+    retriever: Retriever,
+    tokenizer: PreTrainedTokenizer,
+    dataset: list[dict],
+    top_k: int = 10,
+    batch_size: int = 32,
+    forward_batch_size: int = 64,
+    padding: Padding = "longest",
+    segmentation: Segmentation = "tokenizer",
+    token_store: PassageTokenStore = None,
+    labeler_cache: LabelerCache = None,
+    exclude_seen: bool = False,
+    hop_top_k: list[int] = None,
+    min_score: float = None,
+    score_gap: float = None,
+    adaptive_hop_k: bool = False,
+) -> Iterator[dict]:
+    nlp = load_spacy(segmentation)
+    with tqdm_rich(total=len(dataset)) as pbar:
+        for start in range(0, len(dataset), batch_size):
+            samples = dataset[start : start + batch_size]
+            results = efficient_rag_batch(
+                labeler,
+                filter,
+                retriever,
+                tokenizer,
+                nlp,
+                samples,
+                top_k=top_k,
+                forward_batch_size=forward_batch_size,
+                padding=padding,
+                token_store=token_store,
+                labeler_cache=labeler_cache,
+                exclude_seen=exclude_seen,
+                hop_top_k=hop_top_k,
+                min_score=min_score,
+                score_gap=score_gap,
+                adaptive_hop_k=adaptive_hop_k,
             )
-            iter += 1
-        yield sample_chunks
+            pbar.update(len(samples))
+            yield from results
 
 
-def main(opt: argparse.Namespace):
+def load_models(
+    opt: argparse.Namespace, device: torch.device
+) -> tuple[PreTrainedModel, PreTrainedModel]:
+    if opt.backend == "onnx":
+        print(f"Loading ONNX labeler and filter from {opt.onnx_dir}")
+        return load_onnx_models(opt.onnx_dir, device, opt.num_threads)
     labeler = (
         DebertaForSequenceTokenClassification.from_pretrained(
             opt.labeler_ckpt, token_labels=2, sequence_labels=opt.labels
         )
-        .cuda()
+        .to(device)
         .eval()
     )
     filter = (
         DebertaV2ForTokenClassification.from_pretrained(opt.filter_ckpt, num_labels=2)
-        .cuda()
+        .to(device)
         .eval()
     )
+    if opt.quantize == "int8":
+        print("Quantizing labeler and filter linear layers to int8")
+        labeler = quantize_int8(labeler)
+        filter = quantize_int8(filter)
+    return labeler, filter
+
+
+def main(opt: argparse.Namespace):
+    device = resolve_device(opt.device)
+    set_num_threads(opt.num_threads)
+    labeler, filter = load_models(opt, device)
     tokenizer = DebertaV2Tokenizer.from_pretrained(MODEL_PATH)
     passage_path = os.path.join(CORPUS_DATA_PATH, opt.dataset, "corpus.jsonl")
     embedding_path = os.path.join(CORPUS_DATA_PATH, opt.dataset, opt.retriever)
@@ -254,7 +706,27 @@ def main(opt: argparse.Namespace):
         passage_embedding_path=embedding_path,
         index_path_dir=embedding_path,
         model_type=opt.retriever,
+        device=opt.device,
+        bf16=opt.bf16,
+        query_cache_size=opt.query_cache_size,
+        result_cache_path=opt.result_cache,
     )
+    token_store_dir = opt.token_store
+    if token_store_dir is None:
+        token_store_dir = os.path.join(CORPUS_DATA_PATH, opt.dataset, "deberta_tokens")
+    token_store = None
+    if PassageTokenStore.exist(token_store_dir):
+        if PassageTokenStore.is_fresh(token_store_dir, passage_path, MODEL_PATH):
+            print(f"Loading passage tokens from {token_store_dir}")
+            token_store = PassageTokenStore(token_store_dir)
+        else:
+            print(
+                f"Ignoring passage tokens in {token_store_dir}, they do not match {passage_path} "
+                f"or the {MODEL_PATH} tokenizer, rerun passage_tokenizer.py"
+            )
+    labeler_cache = None
+    if opt.labeler_cache_size > 0:
+        labeler_cache = LabelerCache(opt.labeler_cache_size)
     dataset = load_jsonl(
         os.path.join(
             SYNTHESIZED_NEXT_QUERY_EXTRACTED_DATA_PATH, opt.dataset, "valid.jsonl"
@@ -269,15 +741,52 @@ def main(opt: argparse.Namespace):
     )
     import time
     start = time.time()
-    with open(output_path, "w+", encoding="utf-8") as f:
+    with open(output_path, "w+", encoding="utf-8") as f, inference_context(
+        device, bf16=opt.bf16
+    ):
         for chunk in efficient_rag(
-            labeler, filter, retriever, tokenizer, dataset, top_k=opt.topk
+            labeler,
+            filter,
+            retriever,
+            tokenizer,
+            dataset,
+            top_k=opt.topk,
+            batch_size=opt.batch_size,
+            forward_batch_size=opt.forward_batch_size,
+            padding=opt.padding,
+            segmentation=opt.segmentation,
+            token_store=token_store,
+            labeler_cache=labeler_cache,
+            exclude_seen=opt.exclude_seen,
+            hop_top_k=opt.hop_topk,
+            min_score=opt.min_score,
+            score_gap=opt.score_gap,
+            adaptive_hop_k=opt.adaptive_hop_k,
         ):
             d = json.dumps(chunk, ensure_ascii=False)
             f.write(d + "\n")
     end = time.time()
     print(f"Retrieval time: {end - start:.2f}s")
     print(f"Average retrieval time: {(end - start) / len(dataset):.2f}s")
+    print(f"Throughput: {len(dataset) / (end - start):.2f} questions/s")
+    if labeler_cache is not None:
+        stats = labeler_cache.stats()
+        print(
+            f"Labeler cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"hit rate {stats['hit_rate']:.2%}"
+        )
+    if retriever.query_cache is not None:
+        stats = retriever.query_cache.stats()
+        print(
+            f"Query embedding cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"hit rate {stats['hit_rate']:.2%}, {stats['memory_mb']:.1f} MB"
+        )
+    if retriever.result_cache is not None:
+        stats = retriever.result_cache.stats()
+        print(
+            f"Retrieval result cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"hit rate {stats['hit_rate']:.2%}"
+        )
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
 from .contriever import Contriever
 from .e5 import E5BaseV2Embedding, E5LargeV2Embedding, E5MistralInstructEmbedding
 from .embedder import Embedder, EmbeddingModelTypes, ModelCheckpointMapping, ModelTypes
+from .query_cache import QueryEmbeddingCache
@@ -12,8 +12,10 @@ class AdaEmbedding(DenseEmbedding):
         self,
         embedding_model: str = "text-embedding-ada-002",
         api_version: str = "2024-02-15-preview",
+        device: str = "auto",
+        bf16: bool = False,
     ):
-        super().__init__(embedding_model, embedding_vector_size=1536)
+        super().__init__(embedding_model, embedding_vector_size=1536, device=device, bf16=bf16)
         self.model = AOAI(embedding_model=embedding_model, api_version=api_version)
 
     def instantiate(self):
@@ -4,6 +4,7 @@ import torch
 from transformers import AutoModel, AutoTokenizer
 
 from .base import BaseEmbedding
+from .utils.device import inference_context, resolve_device
 
 Pooling = Union[str, Literal["average", "cls"]]
 
@@ -15,6 +16,8 @@ class DenseEmbedding(BaseEmbedding):
         embedding_vector_size: int,
         no_fp16: bool = False,
         pooling_type: Pooling = "average",
+        device: str = "auto",
+        bf16: bool = False,
     ):
         super().__init__()
         self.model_name_or_path = model_name_or_path
@@ -22,14 +25,18 @@ class DenseEmbedding(BaseEmbedding):
         self.model = None
         self.tokenizer = None
         self.fp16 = not no_fp16
+        # bf16 autocast on CPU is opt-in, it changes the vectors against stored passages
+        self.bf16 = bf16
         self.pooling_type = pooling_type
+        self.device = resolve_device(device)
 
     def instantiate(self):
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name_or_path)
         self.model = AutoModel.from_pretrained(self.model_name_or_path)
         self.model.eval()
-        self.model = self.model.cuda()
-        if self.fp16:
+        self.model = self.model.to(self.device)
+        # half precision on CPU goes through bf16 autocast instead
+        if self.fp16 and self.device.type == "cuda":
             self.model = self.model.half()
 
     def embed(self, query: str):
@@ -42,7 +49,7 @@ class DenseEmbedding(BaseEmbedding):
         if self.model is None:
             self.instantiate()
 
-        with torch.no_grad():
+        with inference_context(self.device, bf16=self.bf16):
             inputs = self.tokenizer(
                 queries,
                 return_tensors="pt",
@@ -50,9 +57,11 @@ class DenseEmbedding(BaseEmbedding):
                 truncation=True,
                 max_length=512,
             )
-            inputs = {k: v.cuda() for k, v in inputs.items()}
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
             outputs = self.model(**inputs)
             embeddings = self.pooling(outputs.last_hidden_state, inputs["attention_mask"])
+            if embeddings.dtype == torch.bfloat16:
+                embeddings = embeddings.float()
             embeddings = embeddings.cpu().numpy()
             return embeddings
 
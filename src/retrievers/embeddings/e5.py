@@ -3,6 +3,7 @@ from torch._tensor import Tensor
 import torch.nn.functional as F
 
 from .dense_embedding import DenseEmbedding
+from .utils.device import inference_context
 
 
 class E5Embedding(DenseEmbedding):
@@ -11,6 +12,8 @@ class E5Embedding(DenseEmbedding):
         model_name_or_path: str,
         embedding_vector_size: int,
         pooling_type: str = None,
+        device: str = "auto",
+        bf16: bool = False,
     ):
         if pooling_type is None:
             pooling_type = "e5-average"
@@ -18,6 +21,8 @@ class E5Embedding(DenseEmbedding):
             model_name_or_path=model_name_or_path,
             embedding_vector_size=embedding_vector_size,
             pooling_type=pooling_type,
+            device=device,
+            bf16=bf16,
         )
 
     def pooling(self, last_hidden_states, attention_mask) -> Tensor:
@@ -28,33 +33,39 @@ class E5Embedding(DenseEmbedding):
 
 
 class E5BaseV2Embedding(E5Embedding):
-    def __init__(self, model_name_or_path: str = None):
+    def __init__(self, model_name_or_path: str = None, device: str = "auto", bf16: bool = False):
         if model_name_or_path is None:
             model_name_or_path = "intfloat/e5-base-v2"
         super().__init__(
             model_name_or_path=model_name_or_path,
             embedding_vector_size=768,
+            device=device,
+            bf16=bf16,
         )
 
 
 class E5LargeV2Embedding(E5Embedding):
-    def __init__(self, model_name_or_path: str = None):
+    def __init__(self, model_name_or_path: str = None, device: str = "auto", bf16: bool = False):
         if model_name_or_path is None:
             model_name_or_path = "intfloat/e5-large-v2"
         super().__init__(
             model_name_or_path=model_name_or_path,
             embedding_vector_size=1024,
+            device=device,
+            bf16=bf16,
         )
 
 
 class E5MistralInstructEmbedding(E5Embedding):
-    def __init__(self, model_name_or_path: str = None):
+    def __init__(self, model_name_or_path: str = None, device: str = "auto", bf16: bool = False):
         if model_name_or_path is None:
             model_name_or_path = "intfloat/e5-mistral-7b-instruct"
         super().__init__(
             model_name_or_path=model_name_or_path,
             embedding_vector_size=4096,
             pooling_type="last_token_pool",
+            device=device,
+            bf16=bf16,
         )
 
         self.template = "Instruct: {task_description}\nQuery: {query}"
@@ -81,7 +92,7 @@ class E5MistralInstructEmbedding(E5Embedding):
         if self.model is None or self.tokenizer is None:
             self.instantiate()
 
-        with torch.no_grad():
+        with inference_context(self.device, bf16=self.bf16):
             batch_dict = self.tokenizer(
                 queries,
                 max_length=self.max_length - 1,
@@ -98,8 +109,10 @@ class E5MistralInstructEmbedding(E5Embedding):
                 return_attention_mask=True,
                 return_tensors="pt",
             )
-            batch_dict = {k: v.cuda() for k, v in batch_dict.items()}
+            batch_dict = {k: v.to(self.device) for k, v in batch_dict.items()}
             outputs = self.model(**batch_dict)
             embeddings = self.pooling(outputs.last_hidden_state, batch_dict["attention_mask"])
+        if embeddings.dtype == torch.bfloat16:
+            embeddings = embeddings.float()
         embeddings = embeddings.cpu().numpy()
         return embeddings
@@ -47,10 +47,12 @@ class Embedder(object):
         text_lower_case: bool = False,
         text_normalize: bool = False,
         no_title: bool = False,
+        device: str = "auto",
+        bf16: bool = False,
     ):
         if model_name_or_path is None:
             model_name_or_path = ModelCheckpointMapping[model_type]
-        self.embedder = ModelTypes[model_type](model_name_or_path)
+        self.embedder = ModelTypes[model_type](model_name_or_path, device=device, bf16=bf16)
         self.batch_size = batch_size
         self.chunk_size = chunk_size
 
@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class QueryEmbeddingCache(object):
+    """
+    Bounded LRU cache of query vectors keyed by (model type, processed text).
+    Memory is bounded by max_size vectors of the embedding dim. A lock guards
+    the dict, the baselines search from a thread pool.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[np.ndarray]:
+        with self.lock:
+            value = self.data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.data.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple[str, str], value: np.ndarray):
+        # copy so a cached row does not keep its whole batch alive
+        value = np.array(value, copy=True)
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self.data),
+                "memory_mb": sum(value.nbytes for value in self.data.values()) / 1024**2,
+            }
@@ -0,0 +1,31 @@
+import contextlib
+from typing import Union
+
+import torch
+
+
+def resolve_device(device: Union[str, torch.device] = "auto") -> torch.device:
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch.device(device)
+
+
+def cpu_supports_bf16() -> bool:
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def set_num_threads(num_threads: int = None):
+    if num_threads is not None and num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+
+def inference_context(device: torch.device, bf16: bool = False) -> contextlib.ExitStack:
+    """torch.inference_mode, with bf16 autocast on CPUs that support it."""
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    if bf16 and device.type == "cpu" and cpu_supports_bf16():
+        stack.enter_context(torch.autocast("cpu", dtype=torch.bfloat16))
+    return stack
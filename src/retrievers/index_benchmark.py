@@ -0,0 +1,327 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Tuple, get_args
+
+import numpy as np
+
+# vector_index is imported as a top level package, the retrievers package
+# __init__ pulls in torch and the embedding models, which are not needed here
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from vector_index import BinaryIndex, FaissIndex, NumpyIndex, ShardedFaissIndex
+from vector_index.faiss_index import IndexType
+from vector_index.shards import list_shards, read_manifest, write_manifest, write_shard
+
+RECALL_KS = (1, 5, 10, 20)
+BACKENDS = ["numpy", "numpy_fp16", "binary", "sharded", "rerank", "pca", "opq"]
+INDEX_CLASSES = {
+    "faiss": FaissIndex,
+    "sharded": ShardedFaissIndex,
+    "numpy": NumpyIndex,
+    "binary": BinaryIndex,
+}
+# (index class key, constructor kwargs), plain data so it can be sent to a subprocess
+IndexSpec = Tuple[str, dict]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build every index type over the same embeddings and report build time, size, "
+        "memory, query latency percentiles and recall against exact Flat search"
+    )
+    parser.add_argument(
+        "--embeddings",
+        type=str,
+        default=None,
+        help="npy shard dir from passage_embedder, synthetic vectors are generated if not set",
+    )
+    parser.add_argument("--data", type=str, choices=["random", "clustered"], default="clustered")
+    parser.add_argument("--num_clusters", type=int, default=1000)
+    parser.add_argument("--num_vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--num_shards", type=int, default=4)
+    parser.add_argument("--num_queries", type=int, default=1024)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 32, 256])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--index_types",
+        type=str,
+        nargs="+",
+        default=list(get_args(IndexType)),
+        help="faiss index types to build, all of IndexType by default",
+    )
+    parser.add_argument(
+        "--backends",
+        type=str,
+        nargs="*",
+        choices=BACKENDS,
+        default=["numpy", "numpy_fp16", "binary", "sharded", "rerank", "pca"],
+        help="other indexes to build: numpy exact search, binary codes, a sharded Flat index, "
+        "PQ16 with exact re-rank and Flat over PCA or OPQ reduced vectors",
+    )
+    parser.add_argument("--train_sample_size", type=int, default=50000)
+    parser.add_argument("--rerank_k", type=int, default=100)
+    parser.add_argument("--reduce_dim", type=int, default=None, help="defaults to dim / 4")
+    parser.add_argument("--output", type=str, default="index_benchmark", help="writes <output>.json and <output>.csv")
+    args = parser.parse_args()
+    return args
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_shards(
+    output_dir: str,
+    num_vectors: int,
+    dim: int,
+    num_shards: int,
+    num_clusters: int = None,
+    seed: int = 0,
+):
+    """
+    Unit vectors, uniformly random or, with num_clusters, drawn around
+    random centers, which is closer to how passage embeddings are spread.
+    """
+    rng = np.random.default_rng(seed)
+    centers = None
+    if num_clusters:
+        centers = normalize(rng.standard_normal((num_clusters, dim)))
+    shards = []
+    for idx, ids in enumerate(np.array_split(np.arange(num_vectors), num_shards)):
+        embeddings = rng.standard_normal((len(ids), dim))
+        if centers is not None:
+            embeddings = centers[rng.integers(num_clusters, size=len(ids))] + 0.5 * embeddings / np.sqrt(dim)
+        embeddings = normalize(embeddings).astype("float32")
+        shards.append(write_shard(output_dir, idx, [str(i) for i in ids], embeddings))
+    write_manifest(output_dir, "clustered" if num_clusters else "random", dim, "float32", shards)
+
+
+def sample_queries(passage_embeddings, num_queries: int, seed: int = 0) -> np.ndarray:
+    """Perturbed passage vectors, so every query has close neighbours."""
+    rng = np.random.default_rng(seed)
+    first = np.load(passage_embeddings[0], mmap_mode="r")
+    rows = rng.choice(len(first), size=min(num_queries, len(first)), replace=False)
+    queries = np.asarray(first[np.sort(rows)], dtype="float32")
+    queries = queries + 0.5 * rng.standard_normal(queries.shape).astype("float32") / np.sqrt(queries.shape[1])
+    return normalize(queries).astype("float32")
+
+
+def recall(results, truth, k: int) -> float:
+    hits = [len(set(ids[:k]) & set(true_ids[:k])) / k for (ids, _), (true_ids, _) in zip(results, truth)]
+    return float(np.mean(hits))
+
+
+def latency_ms(index, queries: np.ndarray, top_k: int, batch_size: int, repeat: int) -> Dict[str, float]:
+    """Percentiles of the wall time of one search call over batch_size queries."""
+    timings = []
+    for _ in range(repeat):
+        for begin in range(0, len(queries), batch_size):
+            start = time.perf_counter()
+            index.search(queries[begin : begin + batch_size], top_k)
+            timings.append((time.perf_counter() - start) * 1000)
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {
+        f"bs{batch_size}_p50_ms": float(p50),
+        f"bs{batch_size}_p95_ms": float(p95),
+        f"bs{batch_size}_p99_ms": float(p99),
+        f"bs{batch_size}_qps": float(len(timings) * batch_size / (sum(timings) / 1000)),
+    }
+
+
+def rss_mb() -> float:
+    """Current resident memory, the peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024**2
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    """
+    High water mark of the resident memory. VmHWM starts over with the new
+    program of a spawned process, ru_maxrss keeps the parent's size at fork.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def dir_size_mb(paths: List[str]) -> float:
+    total = 0
+    for path in paths:
+        if os.path.isfile(path):
+            total += os.path.getsize(path)
+            continue
+        for root, _, files in os.walk(path):
+            total += sum(os.path.getsize(os.path.join(root, fname)) for fname in files)
+    return total / 1024**2
+
+
+def index_specs(dim: int, opt: argparse.Namespace) -> Dict[str, IndexSpec]:
+    """Benchmark name -> index spec, every IndexType first, then the other backends."""
+    reduce_dim = opt.reduce_dim or dim // 4
+    train = {"dim": dim, "train_sample_size": opt.train_sample_size}
+    specs = {index_type: ("faiss", dict(train, index_type=index_type)) for index_type in opt.index_types}
+    backends = {
+        "numpy": ("numpy fp32 mmap", ("numpy", {"dim": dim, "dtype": "float32"})),
+        "numpy_fp16": ("numpy fp16 memory", ("numpy", {"dim": dim, "dtype": "float16", "in_memory": True})),
+        "binary": (f"binary rerank{opt.rerank_k}", ("binary", {"dim": dim, "rerank_k": opt.rerank_k})),
+        "sharded": ("Flat sharded x2", ("sharded", {"num_shards": 2, "dim": dim, "index_type": "Flat"})),
+        "rerank": (f"PQ16 rerank{opt.rerank_k}", ("faiss", dict(train, index_type="PQ16", rerank_k=opt.rerank_k))),
+        "pca": (f"Flat pca{reduce_dim}", ("faiss", dict(train, index_type="Flat", reduce_dim=reduce_dim))),
+        "opq": (
+            f"Flat opq{reduce_dim}",
+            ("faiss", dict(train, index_type="Flat", reduce_dim=reduce_dim, reduction="opq")),
+        ),
+    }
+    for backend in opt.backends:
+        name, spec = backends[backend]
+        specs[name] = spec
+    return specs
+
+
+def run_benchmark(
+    name: str,
+    spec: IndexSpec,
+    passage_embeddings: List[str],
+    queries: np.ndarray,
+    truth: List[Tuple[List[object], List[float]]],
+    index_dir: str,
+    batch_sizes: List[int],
+    repeat: int,
+) -> dict:
+    """
+    Runs in a fresh subprocess per index, so rss_mb is the resident memory the
+    built index adds to an idle process and peak_rss_mb the most it took.
+    """
+    row = {"index": name}
+    try:
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        kind, kwargs = spec
+        index = INDEX_CLASSES[kind](**kwargs)
+        index.load_data(passage_embeddings)
+        if isinstance(index, (FaissIndex, ShardedFaissIndex)) and index.rerank_k is not None:
+            index.attach_rerank_vectors(passage_embeddings, index_dir)
+        row["build_s"] = time.perf_counter() - start
+        row["rss_mb"] = rss_mb() - rss_before
+        row["peak_rss_mb"] = peak_rss_mb() - rss_before
+
+        index.serialize(index_dir)
+        if index.exist_index(index_dir):
+            row["disk_mb"] = dir_size_mb([index_dir])
+        else:
+            # searched straight from the embedding shards
+            row["disk_mb"] = dir_size_mb(passage_embeddings)
+
+        results = index.search(queries, max(RECALL_KS))
+        for k in RECALL_KS:
+            row[f"recall@{k}"] = recall(results, truth, k)
+        for batch_size in batch_sizes:
+            row.update(latency_ms(index, queries, max(RECALL_KS), batch_size, repeat))
+    except Exception as e:
+        # e.g. factory strings that do not support inner product
+        message = str(e).strip()
+        row = {"index": name, "error": message.splitlines()[-1] if message else repr(e)}
+    return row
+
+
+def format_row(row: dict, batch_sizes: List[int]) -> str:
+    recalls = ", ".join("recall@%d %.4f" % (k, row["recall@%d" % k]) for k in RECALL_KS)
+    latencies = ", ".join("bs %d p50 %.2f ms" % (b, row["bs%d_p50_ms" % b]) for b in batch_sizes)
+    return (
+        f"{row['index']}: build {row['build_s']:.2f}s, disk {row['disk_mb']:.1f} MB, "
+        f"rss {row['rss_mb']:.1f} MB (peak {row['peak_rss_mb']:.1f}), {recalls}, {latencies}"
+    )
+
+
+def write_report(rows: List[dict], output: str, meta: dict):
+    with open(f"{output}.json", "w") as f:
+        json.dump({"meta": meta, "results": rows}, f, indent=2)
+    columns = []
+    for row in rows:
+        columns.extend(column for column in row if column not in columns)
+    with open(f"{output}.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Wrote {output}.json and {output}.csv")
+
+
+def main(opt: argparse.Namespace):
+    embedding_dir = opt.embeddings
+    if embedding_dir is None:
+        embedding_dir = tempfile.mkdtemp(prefix="index_benchmark_")
+        print(f"Writing {opt.num_vectors} {opt.data} {opt.dim}-d vectors to {embedding_dir}")
+        num_clusters = opt.num_clusters if opt.data == "clustered" else None
+        synthetic_shards(embedding_dir, opt.num_vectors, opt.dim, opt.num_shards, num_clusters)
+    passage_embeddings = list_shards(embedding_dir)
+    dim = read_manifest(embedding_dir)["dim"]
+    queries = sample_queries(passage_embeddings, opt.num_queries)
+
+    print("Computing ground truth with exact Flat search")
+    exact = FaissIndex(dim, "Flat")
+    exact.load_data(passage_embeddings)
+    truth = exact.search(queries, max(RECALL_KS))
+    truth_ids = exact.id_table
+    del exact
+
+    rows = []
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="index_benchmark_indexes_") as index_root:
+        for idx, (name, spec) in enumerate(index_specs(dim, opt).items()):
+            print(f"Benchmarking {name}")
+            index_dir = os.path.join(index_root, str(idx))
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    row = pool.submit(
+                        run_benchmark,
+                        name,
+                        spec,
+                        passage_embeddings,
+                        queries,
+                        truth,
+                        index_dir,
+                        opt.batch_sizes,
+                        opt.repeat,
+                    ).result()
+            except BrokenProcessPool:
+                row = {"index": name, "error": "benchmark process died, likely out of memory"}
+            rows.append(row)
+            if "error" in row:
+                print(f"{name} failed: {row['error']}")
+            else:
+                print(format_row(row, opt.batch_sizes))
+
+    meta = {
+        "embeddings": embedding_dir,
+        "num_vectors": len(truth_ids),
+        "dim": dim,
+        "num_queries": len(queries),
+        "batch_sizes": opt.batch_sizes,
+        "repeat": opt.repeat,
+        "data": opt.data if opt.embeddings is None else "embeddings",
+    }
+    write_report(rows, opt.output, meta)
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    main(options)
@@ -1,12 +1,27 @@
 import argparse
 import os
-import pickle
 import sys
 
+import numpy as np
+
 from embeddings import Embedder, ModelTypes
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 from retrievers.utils.utils import load_passages
+from retrievers.vector_index.reduction import (
+    REDUCTION_FNAME,
+    apply_reduction,
+    format_recall,
+    learn_reduction,
+    reduction_recall,
+    save_reduction,
+)
+from retrievers.vector_index.shards import (
+    check_shards,
+    write_manifest,
+    write_pickle_shard,
+    write_shard,
+)
 
 
 def parse_args():
@@ -22,6 +37,27 @@ def parse_args():
     parser.add_argument("--model_name_or_path", type=str, default=None)
     parser.add_argument("--batch_size", type=int, default=1024)
     parser.add_argument("--chunk_size", type=int, default=int(2e6), help="passages per chunk")
+    parser.add_argument("--device", type=str, default="auto", help="auto, cpu or cuda")
+    parser.add_argument(
+        "--bf16", action="store_true", help="bf16 autocast on CPUs that support it"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="npy",
+        choices=["npy", "pickle"],
+        help="npy: memory mappable shards with a manifest, pickle: legacy (ids, embeddings)",
+    )
+    parser.add_argument(
+        "--reduce_dim",
+        type=int,
+        default=None,
+        help="store embeddings reduced to this dimension, the queries are reduced by the Retriever",
+    )
+    parser.add_argument("--reduction", type=str, default="pca", choices=["pca", "opq"])
+    parser.add_argument(
+        "--reduction_sample", type=int, default=100000, help="passages of the first chunk to learn the reduction on"
+    )
     parser.add_argument("--test_mode", action="store_true", help="Run in test mode")
     args = parser.parse_args()
     return args
@@ -34,17 +70,45 @@ def main(opts):
         batch_size=opts.batch_size,
         chunk_size=opts.chunk_size,
         text_normalize=True,
+        device=opts.device,
+        bf16=opts.bf16,
     )
     print(f"Loading passages from {opts.passages}")
     data = load_passages(opts.passages)
     output_dir = opts.output_dir
     if not os.path.isdir(output_dir):
         os.makedirs(output_dir)
+    if opts.reduce_dim is not None and opts.format != "npy":
+        raise ValueError("--reduce_dim needs the npy format")
+    shards = []
+    transform = None
+    reduction = None
     for idx, (ids, embeddings) in embedder.embed_passages(data):
-        output_file = os.path.join(output_dir, f"passages_{idx:02d}")
-        with open(output_file, "wb") as f:
-            pickle.dump((ids, embeddings), f)
-        print(f"Save {len(ids)} embeddings to {output_file}")
+        if opts.reduce_dim is not None:
+            if transform is None:
+                rng = np.random.default_rng(0)
+                sample = embeddings[rng.permutation(len(embeddings))[: opts.reduction_sample]]
+                transform = learn_reduction(sample, opts.reduce_dim, opts.reduction)
+                recall = reduction_recall(transform, sample)
+                print(f"{opts.reduction} {embeddings.shape[1]} -> {opts.reduce_dim} vs full dimension: {format_recall(recall)}")
+                save_reduction(transform, output_dir)
+                reduction = {
+                    "method": opts.reduction,
+                    "input_dim": embeddings.shape[1],
+                    "fname": REDUCTION_FNAME,
+                    "recall": recall,
+                }
+            embeddings = apply_reduction(transform, embeddings)
+        if opts.format == "npy":
+            shard = write_shard(output_dir, idx, ids, embeddings)
+        else:
+            shard = write_pickle_shard(output_dir, idx, ids, embeddings)
+        shards.append(shard)
+        print(f"Save {len(ids)} embeddings to {os.path.join(output_dir, shard['name'])}")
+    if opts.format == "npy":
+        write_manifest(output_dir, opts.model_type, embeddings.shape[1], str(embeddings.dtype), shards, reduction)
+        for problem in check_shards(output_dir):
+            print(problem)
 
 
 if __name__ == "__main__":
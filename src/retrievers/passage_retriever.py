@@ -1,8 +1,9 @@
 import argparse
 import os
 import sys
-from glob import glob
-from typing import List, Union
+from typing import List, Literal, Set, Union
+
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 from retrievers.embeddings import (
@@ -10,13 +11,22 @@ from retrievers.embeddings import (
     EmbeddingModelTypes,
     ModelCheckpointMapping,
     ModelTypes,
+    QueryEmbeddingCache,
 )
-from retrievers.utils.utils import load_passages
-from retrievers.vector_index import FaissIndex
-from retrievers.vector_index.faiss_index import IndexType
+from retrievers.embeddings.utils.normalize_text import normalize
+from retrievers.passage_store import PassageStore
+from retrievers.result_cache import RetrievalResultCache, directory_fingerprint
+from retrievers.vector_index import BinaryIndex, FaissIndex, NumpyIndex, ShardedFaissIndex
+from retrievers.vector_index.faiss_index import IndexType, SearchParams
+from retrievers.vector_index.reduction import apply_reduction, load_reduction
+from retrievers.vector_index.shards import append_shard, compact_shards, list_shards
 
 os.environ["TOKENIZERS_PARALLELISM"] = "true"
 
+# faiss: FaissIndex over index_type, numpy: exact BLAS search over the shards,
+# binary: sign bit Hamming search re-ranked with the float shards
+IndexBackend = Literal["faiss", "numpy", "binary"]
+
 
 class Retriever(object):
     def __init__(
@@ -31,44 +41,229 @@ class Retriever(object):
         embed_vector_dim: int = None,
         index_type: IndexType = "Flat",
         max_search_batch_size: int = 2048,
+        device: str = "auto",
+        embedding_memmap_path: str = None,
+        search_params: SearchParams = None,
+        train_sample_size: int = None,
+        memory_budget_gb: float = None,
+        rerank_k: int = None,
+        num_index_shards: int = 1,
+        num_search_threads: int = None,
+        query_cache_size: int = 10000,
+        result_cache_path: str = None,
+        index_backend: IndexBackend = "faiss",
+        reduce_dim: int = None,
+        reduction: str = "pca",
+        bf16: bool = False,
     ):
+        """
+        query_cache_size bounds the cached query vectors, 0 disables the cache.
+        result_cache_path is a SQLite file keeping ranked results across runs.
+        bf16 embeds queries under bf16 autocast on CPUs that support it.
+        """
         if model_path is None:
             model_path = ModelCheckpointMapping[model_type]
-        self.embedder = Embedder(model_type, model_path, batch_size)
+        self.embedder = Embedder(model_type, model_path, batch_size, device=device, bf16=bf16)
+        self.model_type = model_type
+        self.query_cache = QueryEmbeddingCache(query_cache_size) if query_cache_size > 0 else None
         if embed_vector_dim is None:
             embed_vector_dim = self.embedder.get_dim()
-        self.index = FaissIndex(embed_vector_dim, index_type, max_search_batch_size)
+        # shards stored reduced by passage_embedder --reduce_dim
+        self.reduction = None
+        if passage_embedding_path is not None:
+            self.reduction = load_reduction(passage_embedding_path)
+        if self.reduction is not None:
+            embed_vector_dim = self.reduction.d_out
+        index_kwargs = dict(
+            dim=embed_vector_dim,
+            index_type=index_type,
+            max_search_batch_size=max_search_batch_size,
+            search_params=search_params,
+            train_sample_size=train_sample_size,
+            memory_budget_gb=memory_budget_gb,
+            rerank_k=rerank_k,
+            reduce_dim=reduce_dim,
+            reduction=reduction,
+        )
+        if index_backend == "numpy":
+            self.index = NumpyIndex(embed_vector_dim)
+        elif index_backend == "binary":
+            self.index = BinaryIndex(embed_vector_dim, rerank_k=rerank_k or 200)
+        elif num_index_shards > 1:
+            self.index = ShardedFaissIndex(num_index_shards, num_search_threads, **index_kwargs)
+        else:
+            self.index = FaissIndex(**index_kwargs)
         if index_path_dir is None:
             index_path_dir = passage_embedding_path
+        self.passage_embedding_path = passage_embedding_path
+        self.index_path_dir = index_path_dir
+        self.save_or_load_index = save_or_load_index
 
         if save_or_load_index and self.index.exist_index(index_path_dir):
             print(f"Loading index from {index_path_dir}")
             self.index.deserialize(index_path_dir)
         else:
             print(f"Building index from {passage_embedding_path}")
-            self.load_embeddings(passage_embedding_path)
+            self.load_embeddings(
+                passage_embedding_path, embedding_memmap_path, index_path_dir
+            )
             if save_or_load_index:
                 print(f"Saving index to {index_path_dir}")
                 self.index.serialize(index_path_dir)
         print(f"Loading passages from {passage_path}")
-        passages = load_passages(passage_path)
-        self.passage_map = {p["id"]: p for p in passages}
-        print(f"Loaded {len(passages)} passages.")
+        self.passages = PassageStore(passage_path)
+        print(f"Loaded {len(self.passages)} passages.")
+        # settings that change the results of the same index files
+        self.index_options = {
+            "backend": index_backend,
+            "index_type": index_type,
+            "num_index_shards": num_index_shards,
+            "rerank_k": getattr(self.index, "rerank_k", None),
+            "search_params": search_params,
+            "train_sample_size": train_sample_size,
+            "memory_budget_gb": memory_budget_gb,
+            "reduce_dim": reduce_dim,
+            "reduction": reduction,
+            "bf16": bf16,
+        }
+        self.result_cache = None
+        self.result_cache_path = result_cache_path
+        if result_cache_path is not None:
+            self.result_cache = RetrievalResultCache(
+                result_cache_path,
+                self.index_fingerprint(),
+                f"{model_type}:{model_path}",
+                scope=os.path.abspath(index_path_dir),
+            )
+
+    def load_embeddings(
+        self, passage_embedding_path, memmap_path: str = None, rerank_dir: str = None
+    ):
+        embedding_file = list_shards(passage_embedding_path)
+        self.index.load_data(embedding_file, memmap_path)
+        # BinaryIndex maps the shards for re-ranking itself
+        if isinstance(self.index, (FaissIndex, ShardedFaissIndex)) and self.index.rerank_k is not None:
+            self.index.attach_rerank_vectors(embedding_file, rerank_dir or passage_embedding_path)
+
+    def upsert(self, passages: List[dict]):
+        """
+        Embed new or changed passages, append them to the embedding shards,
+        the index and the passage file, then save the index.
+        """
+        if not hasattr(self.index, "upsert"):
+            raise ValueError(f"{type(self.index).__name__} can not be updated, use the faiss index backend")
+        passages = list({str(passage["id"]): passage for passage in passages}.values())
+        ids = [str(passage["id"]) for passage in passages]
+        # checked before the shards are appended, a failed upsert leaves the files untouched
+        self.index.check_upsert(ids)
+        # same text preprocessing as passage_embedder
+        texts = [normalize(self.embedder.process_text(passage)) for passage in passages]
+        embeddings = self.reduce(self.embedder.embed(texts))
+        fpath = append_shard(self.passage_embedding_path, ids, embeddings)
+        self.index.upsert(ids, embeddings, fpath)
+        self.passages.append(passages)
+        self.save_index()
+        print(f"Upserted {len(ids)} passages")
+
+    def delete(self, ids: List[str]):
+        deleted = self.index.delete([str(pid) for pid in ids])
+        self.save_index()
+        print(f"Deleted {deleted} of {len(ids)} passages")
+
+    def compact(self):
+        """Drop deleted and replaced rows from the shards, the index and the passage file."""
+        keep = self.index.live_mask()
+        print(f"Compacting {len(keep) - keep.sum()} of {len(keep)} index rows")
+        embedding_file = compact_shards(self.passage_embedding_path, keep)
+        self.index.rebuild(embedding_file)
+        self.save_index()
+        self.passages.compact(self.index.live_ids())
+
+    def save_index(self):
+        if self.save_or_load_index:
+            self.index.serialize(self.index_path_dir)
+        if self.result_cache is not None:
+            self.result_cache.set_fingerprint(self.index_fingerprint())
+            if not self.save_or_load_index:
+                # the files do not change with an index that is not saved
+                self.result_cache.clear()
 
-    def load_embeddings(self, passage_embedding_path):
-        embedding_file = sorted(glob(f"{passage_embedding_path}/passage*"))
-        self.index.load_data(embedding_file)
+    def index_fingerprint(self) -> str:
+        skip = () if self.result_cache_path is None else (self.result_cache_path,)
+        return directory_fingerprint(self.index_path_dir, skip)
 
-    def search(self, query: Union[str, List[str]], top_k: int = 10):
+    def reduce(self, vectors: np.ndarray) -> np.ndarray:
+        if self.reduction is None:
+            return vectors
+        return apply_reduction(self.reduction, vectors)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        if self.query_cache is None:
+            return self.embedder.embed(queries)
+        keys = [(self.model_type, self.embedder.process_text(query)) for query in queries]
+        vectors = [self.query_cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, vector in zip(keys, vectors) if vector is None))
+        if missing:
+            embeddings = self.embedder.embed([text for _, text in missing])
+            for key, embedding in zip(missing, embeddings):
+                self.query_cache.put(key, embedding)
+            embedded = dict(zip(missing, embeddings))
+            vectors = [embedded[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+        return np.stack(vectors)
+
+    def search_ids(
+        self,
+        queries: List[str],
+        top_k: int,
+        exclude_ids: List[Set[str]] = None,
+        search_params: SearchParams = None,
+    ):
+        if self.result_cache is None:
+            return self.index.search(
+                self.reduce(self.embed_queries(queries)), top_k, exclude_ids=exclude_ids, search_params=search_params
+            )
+        keys = [
+            self.result_cache.key(
+                query,
+                top_k,
+                [sorted(exclude_ids[i]) if exclude_ids is not None else None, search_params, self.index_options],
+            )
+            for i, query in enumerate(queries)
+        ]
+        results = self.result_cache.get_many(keys)
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            found = self.index.search(
+                self.reduce(self.embed_queries([queries[i] for i in missing])),
+                top_k,
+                exclude_ids=[exclude_ids[i] for i in missing] if exclude_ids is not None else None,
+                search_params=search_params,
+            )
+            self.result_cache.put_many([keys[i] for i in missing], found)
+            for i, result in zip(missing, found):
+                results[i] = result
+        return results
+
+    def search(
+        self,
+        query: Union[str, List[str]],
+        top_k: int = 10,
+        exclude_ids: List[Set[str]] = None,
+        search_params: SearchParams = None,
+        return_scores: bool = False,
+    ):
+        """With return_scores, also return the index score of every passage."""
         query = [query] if isinstance(query, str) else query
-        query_vectors = self.embedder.embed(query)
-        top_ids_scores = self.index.search(query_vectors, top_k)
+        top_ids_scores = self.search_ids(query, top_k, exclude_ids, search_params)
         # convert passage id to passage
         docs = [
-            [self.passage_map[doc_id] for doc_id in top_docs]
+            self.passages.get_many(top_docs)
             for top_docs, top_scores in top_ids_scores
         ]
         docs = [doc_list[:top_k] for doc_list in docs]
+        if return_scores:
+            scores = [[float(score) for score in top_scores[:top_k]] for _, top_scores in top_ids_scores]
+            return docs, scores
         return docs
 
 
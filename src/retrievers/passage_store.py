@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import mmap
+import os
+from typing import List, Set
+
+import numpy as np
+
+
+class PassageStore(object):
+    """
+    Lazy access to a jsonl or tsv passage file.
+    A byte offset index over the lines is built once and saved next to the
+    file, passages are parsed from a read only mmap only when they are asked
+    for, so processes reading the same corpus share the OS page cache.
+    Updates are appended to the file, the last line of an id wins, and
+    compact rewrites the file without replaced or deleted passages.
+    """
+
+    offsets_suffix = ".offsets.npy"
+    ids_suffix = ".ids"
+
+    def __init__(self, passage_path: str):
+        if not os.path.exists(passage_path):
+            raise FileNotFoundError(f"{passage_path} does not exist")
+        self.passage_path = passage_path
+        self.is_jsonl = passage_path.endswith(".jsonl")
+        self.file = None
+        self.load()
+
+    def load(self):
+        if not self.index_is_fresh():
+            self.build_index()
+        self.offsets = np.load(self.passage_path + self.offsets_suffix, mmap_mode="r")
+        with open(self.passage_path + self.ids_suffix, "r", encoding="utf-8") as f:
+            content = f.read()
+        self.ids = content.split("\n") if content else []
+        if len(self.ids) + 1 != len(self.offsets):
+            # the files were swapped in between the two reads
+            self.build_index()
+            return self.load()
+        self.id2row = {pid: row for row, pid in enumerate(self.ids)}
+        self.close()
+        self.file = open(self.passage_path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if len(self.ids) else b""
+
+    def close(self):
+        if self.file is None:
+            return
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.file.close()
+        self.file = None
+
+    def __len__(self):
+        return len(self.id2row)
+
+    def __contains__(self, passage_id: str):
+        return passage_id in self.id2row
+
+    def __getitem__(self, passage_id: str) -> dict:
+        row = self.id2row[passage_id]
+        return self.parse(self.mm[self.offsets[row] : self.offsets[row + 1]])
+
+    def get_many(self, passage_ids: List[str]) -> List[dict]:
+        return [self[passage_id] for passage_id in passage_ids]
+
+    def append(self, passages: List[dict]):
+        offsets = self.offsets.tolist()
+        with open(self.passage_path, "ab") as fout:
+            end = fout.tell()
+            if end > 0 and self.mm[end - 1 : end] != b"\n":
+                fout.write(b"\n")
+                end += 1
+            offsets[-1] = end
+            for passage in passages:
+                line = self.format(passage)
+                fout.write(line)
+                offsets.append(offsets[-1] + len(line))
+        # the index files are written after the corpus so they stay fresh
+        self.write_index(offsets, self.ids + [str(passage["id"]) for passage in passages])
+        self.load()
+
+    def compact(self, keep_ids: Set[str]):
+        """Keep the last line of every id in keep_ids, in corpus order."""
+        print(f"Compacting {self.passage_path}")
+        tmp_path = self.passage_path + ".tmp"
+        with open(tmp_path, "wb") as fout:
+            if not self.is_jsonl:
+                fout.write(b"id\ttext\ttitle\n")
+            for row, pid in enumerate(self.ids):
+                if self.id2row[pid] != row or pid not in keep_ids:
+                    continue
+                line = self.mm[self.offsets[row] : self.offsets[row + 1]].rstrip(b"\r\n")
+                fout.write(line + b"\n")
+        self.close()
+        os.replace(tmp_path, self.passage_path)
+        self.load()
+
+    def index_is_fresh(self) -> bool:
+        index_files = [self.passage_path + self.offsets_suffix, self.passage_path + self.ids_suffix]
+        if not all(os.path.exists(fpath) for fpath in index_files):
+            return False
+        corpus_mtime = os.path.getmtime(self.passage_path)
+        return all(os.path.getmtime(fpath) >= corpus_mtime for fpath in index_files)
+
+    def build_index(self):
+        print(f"Building passage offset index for {self.passage_path}")
+        offsets = [0]
+        ids = []
+        with open(self.passage_path, "rb") as fin:
+            for line in iter(fin.readline, b""):
+                passage = self.parse(line) if line.strip() else None
+                if passage is None:
+                    # skip over empty lines and the tsv header
+                    offsets[-1] += len(line)
+                    continue
+                ids.append(str(passage["id"]))
+                offsets.append(offsets[-1] + len(line))
+        self.write_index(offsets, ids)
+
+    def write_index(self, offsets: List[int], ids: List[str]):
+        """
+        Write both index files aside and swap them in, the ids first, so a
+        process reading the corpus at the same time never loads a partial
+        file and sees a stale offsets file until the pair is complete.
+        """
+        offsets_file = self.passage_path + self.offsets_suffix
+        ids_file = self.passage_path + self.ids_suffix
+        tmp_suffix = f".{os.getpid()}.tmp"
+        with open(ids_file + tmp_suffix, "w", encoding="utf-8") as f:
+            f.write("\n".join(ids))
+        with open(offsets_file + tmp_suffix, "wb") as f:
+            np.save(f, np.array(offsets, dtype=np.int64))
+        os.replace(ids_file + tmp_suffix, ids_file)
+        os.replace(offsets_file + tmp_suffix, offsets_file)
+
+    def format(self, passage: dict) -> bytes:
+        if self.is_jsonl:
+            return (json.dumps(passage, ensure_ascii=False) + "\n").encode("utf-8")
+        line = io.StringIO()
+        csv.writer(line, delimiter="\t", lineterminator="\n").writerow(
+            [passage["id"], passage["text"], passage.get("title", "")]
+        )
+        return line.getvalue().encode("utf-8")
+
+    def parse(self, line: bytes) -> dict:
+        line = line.decode("utf-8").strip()
+        if self.is_jsonl:
+            return json.loads(line)
+        row = next(csv.reader([line], delimiter="\t"))
+        if row[0] == "id":
+            return None
+        return {"id": row[0], "title": row[2], "text": row[1]}
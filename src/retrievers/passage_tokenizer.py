@@ -0,0 +1,57 @@
+import argparse
+import os
+import sys
+
+from tqdm import tqdm
+from transformers import DebertaV2Tokenizer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from conf import MODEL_PATH
+from data_module.tokenization import (
+    LABELER_MAX_LENGTH,
+    load_spacy,
+    spacify_batch,
+    tokenize_words,
+)
+from retrievers.token_store import PassageTokenStore
+from retrievers.utils.utils import load_passages
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--passages",
+        type=str,
+        required=True,
+        help="Path to passages (tsv or jsonl file)",
+    )
+    parser.add_argument("--output_dir", type=str, required=True, help="Path to output dir")
+    parser.add_argument("--tokenizer", type=str, default=MODEL_PATH)
+    parser.add_argument("--max_length", type=int, default=LABELER_MAX_LENGTH)
+    parser.add_argument("--batch_size", type=int, default=1024)
+    args = parser.parse_args()
+    return args
+
+
+def main(opts):
+    tokenizer = DebertaV2Tokenizer.from_pretrained(opts.tokenizer)
+    nlp = load_spacy("tokenizer")
+    print(f"Loading passages from {opts.passages}")
+    data = load_passages(opts.passages)
+    passage_ids = [p["id"] for p in data]
+
+    def token_id_batches():
+        for start in tqdm(range(0, len(data), opts.batch_size), desc="Tokenizing"):
+            texts = [p["text"] for p in data[start : start + opts.batch_size]]
+            yield [
+                tokenizer.convert_tokens_to_ids(tokenize_words(words, tokenizer)[: opts.max_length])
+                for words in spacify_batch(texts, nlp, batch_size=opts.batch_size)
+            ]
+
+    PassageTokenStore.write(opts.output_dir, passage_ids, token_id_batches(), opts.passages, opts.tokenizer)
+    print(f"Save token ids of {len(passage_ids)} passages to {opts.output_dir}")
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    main(options)
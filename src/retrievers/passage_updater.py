@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from retrievers.embeddings import ModelTypes
+from retrievers.passage_retriever import Retriever
+from retrievers.token_store import PassageTokenStore
+from retrievers.utils.utils import load_passages
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "action",
+        type=str,
+        choices=["upsert", "delete", "compact"],
+        help="upsert: embed and add or replace passages, delete: drop passage ids, "
+        "compact: rewrite shards, index and passage file without dropped rows",
+    )
+    parser.add_argument("--passages", type=str, required=True, help="document file path")
+    parser.add_argument("--embeddings", type=str, required=True, help="Document embedding path")
+    parser.add_argument("--index_dir", type=str, default=None, help="defaults to the embedding path")
+    parser.add_argument("--model_type", type=str, default="e5-base-v2", choices=list(ModelTypes.keys()))
+    parser.add_argument("--model_name_or_path", type=str, default=None)
+    parser.add_argument("--index_type", type=str, default="Flat")
+    parser.add_argument("--num_index_shards", type=int, default=1)
+    parser.add_argument("--rerank_k", type=int, default=None, help="set if the index was built with re-ranking")
+    parser.add_argument("--input", type=str, default=None, help="upsert: jsonl/tsv passages, delete: one id per line")
+    parser.add_argument("--device", type=str, default="auto", help="auto, cpu or cuda")
+    parser.add_argument(
+        "--token_store",
+        type=str,
+        default=None,
+        help="passage token ids invalidated by upsert and compact, defaults to deberta_tokens next to the passages",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main(opt: argparse.Namespace):
+    retriever = Retriever(
+        opt.passages,
+        opt.embeddings,
+        index_path_dir=opt.index_dir,
+        model_type=opt.model_type,
+        model_path=opt.model_name_or_path,
+        index_type=opt.index_type,
+        rerank_k=opt.rerank_k,
+        num_index_shards=opt.num_index_shards,
+        device=opt.device,
+    )
+    if opt.action == "upsert":
+        retriever.upsert(load_passages(opt.input))
+    elif opt.action == "delete":
+        with open(opt.input, "r", encoding="utf-8") as f:
+            ids = [line.strip() for line in f if line.strip()]
+        retriever.delete(ids)
+    else:
+        retriever.compact()
+    if opt.action != "delete":
+        # the token ids of replaced passages no longer match the corpus
+        token_store_dir = opt.token_store or os.path.join(os.path.dirname(opt.passages), "deberta_tokens")
+        PassageTokenStore.invalidate(token_store_dir)
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    main(options)
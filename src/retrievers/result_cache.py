@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+def directory_fingerprint(dir_path: str, skip: Tuple[str, ...] = ()) -> str:
+    """
+    Hash of the relative path, size and mtime of every file under dir_path,
+    files starting with a path in skip, like a cache database and its
+    journal, are left out.
+    """
+    skip = tuple(os.path.abspath(fpath) for fpath in skip)
+    entries = []
+    for root, _, files in os.walk(dir_path):
+        for fname in files:
+            fpath = os.path.join(root, fname)
+            if os.path.abspath(fpath).startswith(skip) or fname.endswith(".tmp"):
+                continue
+            stat = os.stat(fpath)
+            entries.append((os.path.relpath(fpath, dir_path), stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(json.dumps(sorted(entries)).encode("utf-8")).hexdigest()
+
+
+class RetrievalResultCache(object):
+    """
+    Ranked passage ids and scores of past searches in a SQLite file, so
+    reruns on the same queries skip the index. Keys hash the index
+    fingerprint, the embedding model, the query, top_k and the search
+    options. One file can be shared by several indexes, only the rows of an
+    older fingerprint of the same scope, the index dir, are dropped on open.
+    """
+
+    def __init__(self, db_path: str, index_fingerprint: str, model_key: str, scope: str = None):
+        self.db_path = db_path
+        self.model_key = model_key
+        self.scope = scope
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(key TEXT PRIMARY KEY, fingerprint TEXT, ids TEXT, scores BLOB, scope TEXT)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(results)")]
+        if "scope" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE results ADD COLUMN scope TEXT")
+        self.set_fingerprint(index_fingerprint)
+
+    def set_fingerprint(self, index_fingerprint: str):
+        self.index_fingerprint = index_fingerprint
+        if self.scope is None:
+            return
+        with self.lock, self.conn:
+            deleted = self.conn.execute(
+                "DELETE FROM results WHERE scope = ? AND fingerprint != ?", (self.scope, index_fingerprint)
+            ).rowcount
+        if deleted:
+            print(f"Dropped {deleted} cached results of a changed index from {self.db_path}")
+
+    def key(self, query: str, top_k: int, options: object = None) -> str:
+        content = json.dumps(
+            [self.index_fingerprint, self.model_key, query, top_k, options], sort_keys=True
+        )
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> List[Optional[Tuple[List[str], np.ndarray]]]:
+        with self.lock:
+            rows = {}
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                query = f"SELECT key, ids, scores FROM results WHERE key IN ({','.join('?' * len(batch))})"
+                rows.update({key: (ids, scores) for key, ids, scores in self.conn.execute(query, batch)})
+        results = []
+        for key in keys:
+            if key not in rows:
+                self.misses += 1
+                results.append(None)
+                continue
+            self.hits += 1
+            ids, scores = rows[key]
+            results.append((json.loads(ids), np.frombuffer(scores, dtype="float32")))
+        return results
+
+    def put_many(self, keys: List[str], results: List[Tuple[List[str], np.ndarray]]):
+        rows = [
+            (
+                key,
+                self.index_fingerprint,
+                json.dumps(ids),
+                np.asarray(scores, dtype="float32").tobytes(),
+                self.scope,
+            )
+            for key, (ids, scores) in zip(keys, results)
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO results (key, fingerprint, ids, scores, scope) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def clear(self):
+        """Drop the rows of this scope, or every row without one."""
+        with self.lock, self.conn:
+            if self.scope is None:
+                self.conn.execute("DELETE FROM results")
+            else:
+                self.conn.execute("DELETE FROM results WHERE scope = ?", (self.scope,))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,121 @@
+import itertools
+import json
+import os
+from typing import Iterable
+
+import numpy as np
+
+
+class PassageTokenStore(object):
+    """Tokenizer ids of every corpus passage, memory mapped from disk.
+
+    The ids of all passages are concatenated into one flat array, ``offsets``
+    holds the start of each passage so that a lookup is an array slice.
+    ``meta.json`` records the corpus size and mtime and the tokenizer the ids
+    were built from, a store that no longer matches them is stale.
+    """
+
+    token_ids_fname = "token_ids.npy"
+    offsets_fname = "offsets.npy"
+    passage_ids_fname = "passage_ids.json"
+    meta_fname = "meta.json"
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.token_ids = np.load(
+            os.path.join(store_dir, self.token_ids_fname), mmap_mode="r"
+        )
+        self.offsets = np.load(os.path.join(store_dir, self.offsets_fname), mmap_mode="r")
+        with open(os.path.join(store_dir, self.passage_ids_fname), "r") as f:
+            passage_ids = json.load(f)
+        assert len(passage_ids) + 1 == len(self.offsets), "Offsets should match passage ids"
+        self.id2row = {pid: idx for idx, pid in enumerate(passage_ids)}
+
+    def __len__(self):
+        return len(self.id2row)
+
+    def __contains__(self, passage_id: str):
+        return passage_id in self.id2row
+
+    def get(self, passage_id: str) -> np.ndarray:
+        row = self.id2row[passage_id]
+        return self.token_ids[self.offsets[row] : self.offsets[row + 1]]
+
+    @classmethod
+    def exist(cls, store_dir: str) -> bool:
+        return all(
+            os.path.exists(os.path.join(store_dir, fname))
+            for fname in (cls.token_ids_fname, cls.offsets_fname, cls.passage_ids_fname)
+        )
+
+    @classmethod
+    def is_fresh(cls, store_dir: str, corpus_path: str, tokenizer_name: str) -> bool:
+        meta_file = os.path.join(store_dir, cls.meta_fname)
+        if not os.path.exists(meta_file):
+            return False
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+        return meta == corpus_meta(corpus_path, tokenizer_name)
+
+    @classmethod
+    def invalidate(cls, store_dir: str):
+        """Mark the store stale after the corpus changed, it has to be rebuilt."""
+        meta_file = os.path.join(store_dir, cls.meta_fname)
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+            print(f"Invalidated passage tokens in {store_dir}, rerun passage_tokenizer.py")
+
+    @classmethod
+    def write(
+        cls,
+        store_dir: str,
+        passage_ids: list[str],
+        token_id_batches: Iterable[list[list[int]]],
+        corpus_path: str,
+        tokenizer_name: str,
+        block_size: int = 1 << 24,
+    ):
+        """
+        Stream batches of per passage token ids to disk, only one batch is
+        held as python lists, the flat ids go to a raw int32 file first and
+        are copied into the .npy once their count is known.
+        """
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+        meta_file = os.path.join(store_dir, cls.meta_fname)
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+        token_ids_file = os.path.join(store_dir, cls.token_ids_fname)
+        raw_file = token_ids_file + ".tmp"
+        lengths = []
+        with open(raw_file, "wb") as f:
+            for batch in token_id_batches:
+                lengths.append(np.fromiter(map(len, batch), dtype=np.int64, count=len(batch)))
+                f.write(np.fromiter(itertools.chain.from_iterable(batch), dtype=np.int32).tobytes())
+        lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+        assert len(lengths) == len(passage_ids), "Token ids should match passage ids"
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        total = int(offsets[-1])
+        if total == 0:
+            np.save(token_ids_file, np.zeros(0, dtype=np.int32))
+        else:
+            raw = np.memmap(raw_file, dtype=np.int32, mode="r", shape=(total,))
+            flat = np.lib.format.open_memmap(token_ids_file, mode="w+", dtype=np.int32, shape=(total,))
+            for start in range(0, total, block_size):
+                flat[start : start + block_size] = raw[start : start + block_size]
+            flat.flush()
+            del flat, raw
+        os.remove(raw_file)
+        np.save(os.path.join(store_dir, cls.offsets_fname), offsets)
+        with open(os.path.join(store_dir, cls.passage_ids_fname), "w") as f:
+            json.dump(passage_ids, f)
+        # written last, a store interrupted while writing stays stale
+        with open(meta_file, "w") as f:
+            json.dump(corpus_meta(corpus_path, tokenizer_name), f)
+
+
+def corpus_meta(corpus_path: str, tokenizer_name: str) -> dict:
+    stat = os.stat(corpus_path)
+    return {"corpus_size": stat.st_size, "corpus_mtime_ns": stat.st_mtime_ns, "tokenizer": tokenizer_name}
@@ -1,2 +1,5 @@
 from .base import BaseIndex
 from .faiss_index import FaissIndex
+from .sharded_index import ShardedFaissIndex
+from .numpy_index import NumpyIndex
+from .binary_index import BinaryIndex
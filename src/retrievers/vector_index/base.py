@@ -2,7 +2,7 @@ class BaseIndex:
     def __init__(self):
         pass
 
-    def search(self, query, top_k):
+    def search(self, query, top_k, exclude_ids=None, search_params=None):
         raise NotImplementedError
 
     def serialize(self, dir_path):
@@ -0,0 +1,112 @@
+from typing import List, Set, Tuple
+
+import faiss
+import numpy as np
+from tqdm import tqdm
+
+from .base import BaseIndex
+from .faiss_index import intern_ids
+from .shards import EMBEDDING_SUFFIX, gather_rows, load_shard
+
+
+class BinaryIndex(BaseIndex):
+    """
+    First stage search over sign bit codes, dim / 8 bytes per passage, with
+    a Hamming distance scan, then the rerank_k nearest codes are re-scored
+    with the float vectors read from the memory mapped .npy shards. With
+    center the bits are the signs of the vectors minus their mean, which
+    spreads the codes of embeddings that share a large common direction.
+    """
+
+    def __init__(
+        self,
+        dim: int = 768,
+        rerank_k: int = 200,
+        center: bool = True,
+        max_search_batch_size: int = 2048,
+    ):
+        super().__init__()
+        if dim % 8 != 0:
+            raise ValueError(f"Binary codes need a dim divisible by 8, got {dim}")
+        self.dim = dim
+        self.rerank_k = rerank_k
+        self.center = center
+        self.max_search_batch_size = max_search_batch_size
+        self.block_size = 100_000
+        self.index = faiss.IndexBinaryFlat(dim)
+        self.mean = np.zeros(dim, dtype="float32")
+        self.blocks = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.id_table = np.zeros(0, dtype=object)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(np.asarray(vectors, dtype="float32") > self.mean, axis=1)
+
+    def load_data(self, passage_embeddings: List[str], memmap_path: str = None):
+        shards = [load_shard(fpath) for fpath in passage_embeddings]
+        for fpath, (_, embeddings) in zip(passage_embeddings, shards):
+            if not fpath.endswith(EMBEDDING_SUFFIX):
+                print(f"{fpath} is not a .npy shard, its float vectors are kept in memory")
+        if self.center:
+            total = np.zeros(self.dim, dtype="float64")
+            for _, embeddings in tqdm(shards, desc="Mean embedding"):
+                for start in range(0, len(embeddings), self.block_size):
+                    total += np.asarray(embeddings[start : start + self.block_size], dtype="float64").sum(axis=0)
+            self.mean = (total / max(sum(len(embeddings) for _, embeddings in shards), 1)).astype("float32")
+        ids = []
+        for cur_ids, embeddings in tqdm(shards, desc="Binarize embeddings"):
+            for start in range(0, len(embeddings), self.block_size):
+                self.index.add(self.encode(embeddings[start : start + self.block_size]))
+            ids.extend(cur_ids)
+            self.blocks.append(embeddings)
+        self.offsets = np.cumsum([0] + [len(embeddings) for embeddings in self.blocks]).astype(np.int64)
+        self.id_table = intern_ids(ids)
+        print(
+            f"Total data indexed {len(self.id_table)}, "
+            f"{self.index.code_size * len(self.id_table) / 1024**2:.1f} MB of codes"
+        )
+
+    def gather(self, rows: np.ndarray) -> np.ndarray:
+        """Float vectors of sorted global rows, read shard by shard."""
+        return gather_rows(self.blocks, self.offsets, rows, self.dim)
+
+    def search(
+        self,
+        query_vectors: np.array,
+        top_k: int = 20,
+        exclude_ids: List[Set[str]] = None,
+        search_params=None,
+    ) -> List[Tuple[List[object], List[float]]]:
+        query_vectors = query_vectors.astype("float32")
+        fetch_k = top_k
+        if exclude_ids is not None:
+            fetch_k += max((len(ids) for ids in exclude_ids), default=0)
+        result = []
+        for start in range(0, len(query_vectors), self.max_search_batch_size):
+            q = query_vectors[start : start + self.max_search_batch_size]
+            _, candidates = self.index.search(self.encode(q), max(fetch_k, self.rerank_k))
+            for i, (query_vector, rows) in enumerate(zip(q, candidates)):
+                rows = np.sort(rows[rows >= 0])
+                scores = self.gather(rows) @ query_vector
+                order = np.argsort(-scores)[:fetch_k]
+                db_ids = self.id_table[rows[order]].tolist()
+                scores = scores[order]
+                if exclude_ids is not None:
+                    excluded = exclude_ids[start + i]
+                    keep = [j for j, db_id in enumerate(db_ids) if db_id not in excluded][:top_k]
+                    db_ids, scores = [db_ids[j] for j in keep], scores[keep]
+                result.append((db_ids, scores))
+        return result
+
+    def serialize(self, dir_path):
+        # the codes are rebuilt from the shards, which are needed for re-ranking
+        pass
+
+    def deserialize(self, dir_path):
+        # exist_index is always False, so the index is never loaded from dir_path
+        raise ValueError(
+            f"BinaryIndex has no saved index in {dir_path}, it is rebuilt from the embedding shards with load_data"
+        )
+
+    def exist_index(self, dir_path):
+        return False
@@ -1,6 +1,8 @@
+import json
 import os
 import pickle
-from typing import List, Tuple
+import sys
+from typing import Dict, List, Set, Tuple
 from typing import Literal
 from tqdm import tqdm
 
@@ -8,6 +10,8 @@ import faiss
 import numpy as np
 
 from .base import BaseIndex
+from .reduction import ReductionMethod, format_recall, learn_reduction, reduction_recall
+from .shards import EMBEDDING_SUFFIX, gather_rows, load_shard, shard_shape
 
 IndexType = Literal[
     "Flat",
@@ -16,7 +20,13 @@ IndexType = Literal[
     "PQ16",
     "IVF100,PQ16",
     "LSH",
+    "SQ8",
+    "SQfp16",
+    "OPQ32,PQ32",
+    "IVF1024,SQ8",
+    "auto",
 ]
+SearchParams = Dict[str, int]  # nprobe for IVF, efSearch for HNSW
 
 
 class FaissIndex(BaseIndex):
@@ -26,31 +36,253 @@ class FaissIndex(BaseIndex):
         index_type: IndexType = "Flat",
         max_search_batch_size: int = 2048,
         max_index_batch_size: int = int(1e6),
+        search_params: SearchParams = None,
+        train_sample_size: int = None,
+        memory_budget_gb: float = None,
+        rerank_k: int = None,
+        reduce_dim: int = None,
+        reduction: ReductionMethod = "pca",
     ):
+        """
+        index_type "auto" picks a factory string from the corpus size and
+        memory_budget_gb once the embeddings are loaded. search_params are
+        applied to the index and can be overridden per search call, indexes
+        that need training are trained on train_sample_size random vectors.
+        With rerank_k the index only proposes rerank_k candidates, which are
+        re-scored against the vectors memory mapped from the .npy shards.
+        Faiss ids of new indexes are rows of idx2db, non IVF indexes are
+        wrapped in an IDMap2 for it, so passages can be upserted and deleted
+        by id. With reduce_dim a PCA or OPQ rotation learned on a sample of
+        the passages maps vectors and queries to reduce_dim before the index.
+        """
         super().__init__()
         self.index_fname = "index.faiss"
         self.index_meta_fname = "index_meta.faiss"
+        self.rerank_fname = "rerank_vectors.npy"
+        self.rerank_files_fname = "rerank_files.json"
 
-        self.index = faiss.index_factory(dim, index_type, faiss.METRIC_INNER_PRODUCT)
-        self.idx2db = []
+        self.dim = dim
+        self.index_type = index_type
+        self.search_params = search_params or {}
+        self.train_sample_size = train_sample_size
+        self.memory_budget_gb = memory_budget_gb
+        self.rerank_k = rerank_k
+        self.reduce_dim = reduce_dim
+        self.reduction = reduction
+        # re-rank vectors, the .npy shard memmaps or one copied file for pickle shards
+        self.rerank_blocks = None
+        self.rerank_offsets = np.zeros(1, dtype=np.int64)
+        self.rerank_files = None
+        self.rerank_file = None
+        self.index = None
+        if index_type != "auto" and reduce_dim is None:
+            self.index = new_index(dim, index_type)
+            self.set_search_params(self.search_params)
+        # faiss row -> position in id_table, the passage id strings are kept once.
+        # Deleted rows point to -1, rows are never reused until compaction.
+        self.idx2db = np.zeros(0, dtype=np.int64)
+        self.id_table = np.zeros(0, dtype=object)
+        self.row_of = None
+        # deleted vectors the index could not remove, filtered at search time
+        self.num_stale = 0
 
         self.max_search_batch_size = max_search_batch_size
         self.max_index_batch_size = max_index_batch_size
 
-    def search(self, query_vectors: np.array, top_k: int = 20) -> List[Tuple[List[object], List[float]]]:
+    def search(
+        self,
+        query_vectors: np.array,
+        top_k: int = 20,
+        exclude_ids: List[Set[str]] = None,
+        search_params: SearchParams = None,
+    ) -> List[Tuple[List[object], List[float]]]:
+        """
+        exclude_ids holds one set of passage ids per query that must not be
+        returned, the search over-fetches by the largest set and filters them.
+        search_params override the index search parameters for this call,
+        they are passed to faiss with the query so the shared index is not
+        changed under concurrent searches.
+        """
+        params = self.query_params(search_params) if search_params else None
         query_vectors = query_vectors.astype("float32")
+        if len(self.idx2db) == 0:
+            return [([], np.zeros(0, dtype="float32")) for _ in range(len(query_vectors))]
+        fetch_k = top_k + self.num_stale
+        if exclude_ids is not None:
+            fetch_k += max((len(ids) for ids in exclude_ids), default=0)
         result = []
         batches = (len(query_vectors) - 1) // self.max_search_batch_size + 1
         for idx in range(batches):
             start_idx = idx * self.max_search_batch_size
             end_idx = min((idx + 1) * self.max_search_batch_size, len(query_vectors))
             q = query_vectors[start_idx:end_idx]
-            scores, indexes = self.index.search(q, top_k)
+            if self.rerank_blocks is not None:
+                scores, indexes = self.index.search(q, max(fetch_k, self.rerank_k), params=params)
+                scores, indexes = self.rerank(q, indexes, fetch_k)
+            else:
+                scores, indexes = self.index.search(q, fetch_k, params=params)
             # convert index to passage id
-            db_ids = [[str(self.idx2db[i]) for i in query_indexes] for query_indexes in indexes]
-            result.extend([(db_ids[i], scores[i]) for i in range(len(db_ids))])
+            rows = np.where(indexes >= 0, self.idx2db[indexes], -1)
+            db_ids = self.id_table[rows].tolist()
+            # faiss pads with -1 when fewer than fetch_k vectors are found
+            if exclude_ids is None and self.num_stale == 0 and (rows >= 0).all():
+                result.extend([(db_ids[i], scores[i]) for i in range(len(db_ids))])
+                continue
+            for i in range(len(db_ids)):
+                excluded = exclude_ids[start_idx + i] if exclude_ids is not None else ()
+                keep = [
+                    j
+                    for j, (db_id, row) in enumerate(zip(db_ids[i], rows[i]))
+                    if row >= 0 and db_id not in excluded
+                ][:top_k]
+                result.append(([db_ids[i][j] for j in keep], scores[i][keep]))
         return result
 
+    def rerank(self, query_vectors: np.ndarray, indexes: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = np.full((len(query_vectors), top_k), -np.inf, dtype="float32")
+        reranked = np.full((len(query_vectors), top_k), -1, dtype="int64")
+        for i, (query_vector, candidates) in enumerate(zip(query_vectors, indexes)):
+            # read candidate rows in file order
+            candidates = np.sort(candidates[candidates >= 0])
+            exact_scores = gather_rows(self.rerank_blocks, self.rerank_offsets, candidates, self.dim) @ query_vector
+            order = np.argsort(-exact_scores)[:top_k]
+            scores[i, : len(order)] = exact_scores[order]
+            reranked[i, : len(order)] = candidates[order]
+        return scores, reranked
+
+    def attach_rerank_vectors(self, passage_embeddings: List[str], dir_path: str):
+        """
+        Re-rank from the memory mapped .npy shards, nothing is copied. Legacy
+        pickle shards can not be mapped, their float32 vectors are copied in
+        index order to a file in dir_path instead.
+        """
+        if all(fpath.endswith(EMBEDDING_SUFFIX) for fpath in passage_embeddings):
+            self.rerank_file = None
+            self.set_rerank_files(list(passage_embeddings))
+        else:
+            self.rerank_files = None
+            self.write_rerank_vectors(passage_embeddings, dir_path)
+
+    def set_rerank_files(self, files: List[str]):
+        self.rerank_files = files
+        self.set_rerank_blocks([np.load(fpath, mmap_mode="r") for fpath in files])
+
+    def set_rerank_blocks(self, blocks: List[np.ndarray]):
+        self.rerank_blocks = blocks
+        self.rerank_offsets = np.cumsum([0] + [len(block) for block in blocks]).astype(np.int64)
+
+    def write_rerank_vectors(self, passage_embeddings: List[str], dir_path: str):
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        rerank_file = os.path.join(dir_path, self.rerank_fname)
+        total = sum(shard_shape(fpath)[0] for fpath in passage_embeddings)
+        vectors = np.lib.format.open_memmap(rerank_file + ".tmp", mode="w+", dtype="float32", shape=(total, self.dim))
+        offset = 0
+        for fpath in tqdm(passage_embeddings, desc="Write rerank vectors"):
+            _, embeddings = load_shard(fpath)
+            vectors[offset : offset + len(embeddings)] = embeddings
+            offset += len(embeddings)
+        self.replace_rerank_file(vectors, rerank_file)
+
+    def append_rerank_vectors(self, embeddings: np.ndarray):
+        old = self.rerank_blocks[0]
+        vectors = np.lib.format.open_memmap(
+            self.rerank_file + ".tmp", mode="w+", dtype="float32", shape=(len(old) + len(embeddings), self.dim)
+        )
+        for start in range(0, len(old), self.max_index_batch_size):
+            end = min(start + self.max_index_batch_size, len(old))
+            vectors[start:end] = old[start:end]
+        vectors[len(old) :] = embeddings
+        self.replace_rerank_file(vectors, self.rerank_file)
+
+    def replace_rerank_file(self, vectors: np.memmap, rerank_file: str):
+        vectors.flush()
+        del vectors
+        os.replace(rerank_file + ".tmp", rerank_file)
+        self.rerank_file = rerank_file
+        self.set_rerank_blocks([np.load(rerank_file, mmap_mode="r")])
+
+    def upsert(self, ids: List[str], embeddings: np.ndarray, fpath: str = None):
+        """
+        Add passages, an id that is already indexed has its old vector deleted.
+        fpath is the shard the embeddings were appended to, re-ranking maps it.
+        """
+        self.check_upsert(ids)
+        self.delete(ids)
+        start = len(self.idx2db)
+        rows = np.arange(start, start + len(ids), dtype=np.int64)
+        self.add_vectors(embeddings, start)
+        self.id_table = np.concatenate([self.id_table, intern_ids(ids)])
+        self.idx2db = np.concatenate([self.idx2db, rows])
+        self.get_row_of().update(zip(self.id_table[start:].tolist(), rows.tolist()))
+        if self.rerank_files is not None:
+            if fpath is None:
+                raise ValueError("Re-ranking from the shards needs the shard the upserted vectors were appended to")
+            self.set_rerank_files(self.rerank_files + [fpath])
+        elif self.rerank_blocks is not None:
+            self.append_rerank_vectors(embeddings)
+
+    def check_upsert(self, ids: List[str]):
+        """Raise before anything is written when the passages can not be upserted."""
+        if not is_id_mapped(self.index):
+            raise ValueError("Index was built without an id map, compact it before updating")
+        if len(set(ids)) != len(ids):
+            raise ValueError("Upserted passage ids must be unique")
+
+    def delete(self, ids: List[str]) -> int:
+        row_of = self.get_row_of()
+        rows = np.array([row_of.pop(pid) for pid in ids if pid in row_of], dtype=np.int64)
+        if len(rows) == 0:
+            return 0
+        self.idx2db[rows] = -1
+        if is_id_mapped(self.index):
+            try:
+                self.index.remove_ids(rows)
+                return len(rows)
+            except RuntimeError:
+                pass
+        # HNSW can not remove vectors and an index without id map can not
+        # shift its rows, the vectors stay until compaction
+        self.num_stale += len(rows)
+        return len(rows)
+
+    def rebuild(self, passage_embeddings: List[str]):
+        """
+        Re-add the vectors of compacted shards to an emptied copy of the index,
+        trained quantizers and transforms are kept so nothing is retrained.
+        """
+        index = faiss.clone_index(self.index)
+        index.reset()
+        if not is_id_mapped(index):
+            index = faiss.IndexIDMap2(index)
+        self.index = index
+        self.set_search_params(self.search_params)
+        ids = []
+        for fpath in tqdm(passage_embeddings, desc="Index embeddings"):
+            cur_ids, embeddings = load_shard(fpath)
+            self.add_vectors(embeddings, len(ids))
+            ids.extend(cur_ids)
+        self.set_ids(ids)
+        if self.rerank_blocks is not None:
+            # compacted shards are always .npy, a copied re-rank file is no longer needed
+            if self.rerank_file is not None:
+                os.remove(self.rerank_file)
+                self.rerank_file = None
+            self.set_rerank_files(list(passage_embeddings))
+        print(f"Total data indexed {len(self.idx2db)}")
+
+    def live_mask(self) -> np.ndarray:
+        return self.idx2db >= 0
+
+    def live_ids(self) -> Set[str]:
+        return set(self.id_table[self.idx2db[self.live_mask()]].tolist())
+
+    def get_row_of(self) -> Dict[str, int]:
+        if self.row_of is None:
+            live = np.flatnonzero(self.idx2db >= 0)
+            self.row_of = dict(zip(self.id_table[self.idx2db[live]].tolist(), live.tolist()))
+        return self.row_of
+
     def serialize(self, dir_path):
         index_file = os.path.join(dir_path, self.index_fname)
         meta_file = os.path.join(dir_path, self.index_meta_fname)
@@ -58,35 +290,243 @@ class FaissIndex(BaseIndex):
         if not os.path.exists(dir_path):
             os.makedirs(dir_path)
 
-        faiss.write_index(self.index, index_file)
-        with open(meta_file, "wb") as f:
-            pickle.dump(self.idx2db, f)
+        # write both files aside first so an interrupted update keeps the old pair
+        faiss.write_index(self.index, index_file + ".tmp")
+        meta = {"idx2db": self.idx2db, "id_table": "\n".join(self.id_table.tolist())}
+        with open(meta_file + ".tmp", "wb") as f:
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(index_file + ".tmp", index_file)
+        os.replace(meta_file + ".tmp", meta_file)
+        if self.rerank_files is not None:
+            rerank_files_file = os.path.join(dir_path, self.rerank_files_fname)
+            with open(rerank_files_file + ".tmp", "w", encoding="utf-8") as f:
+                json.dump([os.path.relpath(fpath, dir_path) for fpath in self.rerank_files], f)
+            os.replace(rerank_files_file + ".tmp", rerank_files_file)
 
     def deserialize(self, dir_path):
         index_file = os.path.join(dir_path, self.index_fname)
         meta_file = os.path.join(dir_path, self.index_meta_fname)
         print(f"Loading index from {index_file}, meta data from {meta_file}")
         self.index = faiss.read_index(index_file)
+        self.set_search_params(self.search_params)
         with open(meta_file, "rb") as f:
-            self.idx2db = pickle.load(f)
-        assert len(self.idx2db) == self.index.ntotal, "Deserialized idx2db should match faiss index size"
+            meta = pickle.load(f)
+        if isinstance(meta, list):
+            # legacy meta data, a list of passage ids in index order
+            self.set_ids(meta)
+        else:
+            self.idx2db = meta["idx2db"]
+            self.id_table = intern_ids(meta["id_table"].split("\n") if meta["id_table"] else [])
+            self.row_of = None
+        num_live = int((self.idx2db >= 0).sum())
+        assert num_live <= self.index.ntotal <= len(self.idx2db), "Deserialized idx2db should match faiss index size"
+        self.num_stale = self.index.ntotal - num_live
+        if self.rerank_k is not None:
+            rerank_files_file = os.path.join(dir_path, self.rerank_files_fname)
+            if os.path.exists(rerank_files_file):
+                with open(rerank_files_file, "r", encoding="utf-8") as f:
+                    self.set_rerank_files([os.path.join(dir_path, fpath) for fpath in json.load(f)])
+            else:
+                self.rerank_file = os.path.join(dir_path, self.rerank_fname)
+                self.set_rerank_blocks([np.load(self.rerank_file, mmap_mode="r")])
+            assert self.rerank_offsets[-1] == len(self.idx2db), "Re-rank vectors should cover every index row"
 
     def exist_index(self, dir_path):
         index_file = os.path.join(dir_path, self.index_fname)
         meta_file = os.path.join(dir_path, self.index_meta_fname)
-        return os.path.exists(index_file) and os.path.exists(meta_file)
+        files = [index_file, meta_file]
+        if self.rerank_k is not None and not os.path.exists(os.path.join(dir_path, self.rerank_fname)):
+            files.append(os.path.join(dir_path, self.rerank_files_fname))
+        return all(os.path.exists(fpath) for fpath in files)
+
+    def load_data(self, passage_embeddings: List[str], memmap_path: str = None):
+        """
+        Indexes that need no training get each shard added as it is read, so
+        only one shard is held in memory. Otherwise the shards are copied into
+        one preallocated float32 matrix, disk backed if memmap_path is given,
+        which is used to train the index and then added in batches.
+        """
+        if self.index is None:
+            total = sum(shard_shape(fpath)[0] for fpath in passage_embeddings)
+            transform = None
+            if self.reduce_dim is not None:
+                transform = self.train_reduction(passage_embeddings)
+            auto = self.index_type == "auto"
+            if auto:
+                self.index_type = choose_index_type(total, self.reduce_dim or self.dim, self.memory_budget_gb)
+                print(f"Auto selected index type {self.index_type} for {total} vectors")
+            self.index = new_index(self.dim, self.index_type, transform)
+            self.set_search_params(self.search_params)
+            if auto and self.train_sample_size is None and not self.index.is_trained:
+                self.train_sample_size = min(total, 256 * faiss.extract_index_ivf(self.index).nlist)
 
-    def load_data(self, passage_embeddings: List[str]):
-        embeddings = np.array([])
         ids = []
-        for fpath in tqdm(passage_embeddings, desc="Load embeddings"):
-            with open(fpath, "rb") as fin:
-                cur_ids, cur_embeddings = pickle.load(fin)
-                ids.extend(cur_ids)
-                embeddings = np.vstack((embeddings, cur_embeddings)) if embeddings.size else cur_embeddings
-        embeddings = embeddings.astype("float32")
-        self.idx2db = ids
-        if not self.index.is_trained:
+        if not self.index.is_trained and self.train_sample_size is None:
+            embeddings = self.read_embeddings(passage_embeddings, ids, memmap_path)
             self.index.train(embeddings)
-        self.index.add(embeddings)
+            self.add_vectors(embeddings, 0)
+            self.set_ids(ids)
+            print(f"Total data indexed {len(self.idx2db)}")
+            return
+
+        if not self.index.is_trained:
+            self.index.train(self.sample_embeddings(passage_embeddings, self.train_sample_size))
+        for fpath in tqdm(passage_embeddings, desc="Index embeddings"):
+            cur_ids, embeddings = load_shard(fpath)
+            self.add_vectors(embeddings, len(ids))
+            ids.extend(cur_ids)
+        self.set_ids(ids)
         print(f"Total data indexed {len(self.idx2db)}")
+
+    def train_reduction(self, passage_embeddings: List[str]) -> faiss.VectorTransform:
+        sample = self.sample_embeddings(passage_embeddings, self.train_sample_size or 100_000)
+        transform = learn_reduction(sample, self.reduce_dim, self.reduction)
+        recall = reduction_recall(transform, sample)
+        print(f"{self.reduction} {self.dim} -> {self.reduce_dim} vs full dimension: {format_recall(recall)}")
+        return transform
+
+    def read_embeddings(
+        self, passage_embeddings: List[str], ids: List[str], memmap_path: str = None
+    ) -> np.ndarray:
+        shapes = [shard_shape(fpath) for fpath in passage_embeddings]
+        total = sum(shape[0] for shape in shapes)
+        dim = shapes[0][1]
+        if memmap_path is not None:
+            embeddings = np.memmap(memmap_path, dtype="float32", mode="w+", shape=(total, dim))
+        else:
+            embeddings = np.empty((total, dim), dtype="float32")
+        offset = 0
+        for fpath in tqdm(passage_embeddings, desc="Load embeddings"):
+            cur_ids, cur_embeddings = load_shard(fpath)
+            embeddings[offset : offset + len(cur_ids)] = cur_embeddings
+            offset += len(cur_ids)
+            ids.extend(cur_ids)
+        return embeddings
+
+    def sample_embeddings(self, passage_embeddings: List[str], sample_size: int, seed: int = 0) -> np.ndarray:
+        """Gather sample_size random vectors across the shards for training."""
+        sizes = [shard_shape(fpath)[0] for fpath in passage_embeddings]
+        total = sum(sizes)
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(total, size=min(sample_size, total), replace=False))
+        samples = []
+        offset = 0
+        for fpath, size in tqdm(zip(passage_embeddings, sizes), desc="Sample embeddings", total=len(sizes)):
+            local = rows[(rows >= offset) & (rows < offset + size)] - offset
+            if len(local) > 0:
+                _, embeddings = load_shard(fpath)
+                samples.append(np.asarray(embeddings[local], dtype="float32"))
+            offset += size
+        print(f"Training index on {len(rows)} of {total} vectors")
+        return np.ascontiguousarray(np.concatenate(samples))
+
+    def get_search_params(self) -> SearchParams:
+        params = {}
+        try:
+            params["nprobe"] = faiss.extract_index_ivf(self.index).nprobe
+        except RuntimeError:
+            pass
+        hnsw = find_hnsw(self.index)
+        if hnsw is not None:
+            params["efSearch"] = hnsw.hnsw.efSearch
+        return params
+
+    def set_search_params(self, search_params: SearchParams):
+        """Parameters the index does not have, like nprobe on Flat, are skipped."""
+        parameter_space = faiss.ParameterSpace()
+        for name, value in search_params.items():
+            try:
+                parameter_space.set_index_parameter(self.index, name, value)
+            except RuntimeError:
+                pass
+
+    def query_params(self, search_params: SearchParams) -> faiss.SearchParameters:
+        """Per query faiss parameters, the index settings fill what is not given."""
+        current = self.get_search_params()
+        if "nprobe" in current:
+            params = faiss.SearchParametersIVF()
+            params.nprobe = int(search_params.get("nprobe", current["nprobe"]))
+            return params
+        if "efSearch" in current:
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = int(search_params.get("efSearch", current["efSearch"]))
+            return params
+        return None
+
+    def set_ids(self, ids: List[str]):
+        self.id_table = intern_ids(ids)
+        self.idx2db = np.arange(len(ids), dtype=np.int64)
+        self.row_of = None
+        self.num_stale = 0
+
+    def add_vectors(self, embeddings: np.ndarray, first_row: int):
+        id_mapped = is_id_mapped(self.index)
+        for start in range(0, len(embeddings), self.max_index_batch_size):
+            batch = np.ascontiguousarray(embeddings[start : start + self.max_index_batch_size], dtype="float32")
+            if id_mapped:
+                rows = np.arange(first_row + start, first_row + start + len(batch), dtype=np.int64)
+                self.index.add_with_ids(batch, rows)
+            else:
+                self.index.add(batch)
+
+
+def new_index(dim: int, index_type: str, transform: faiss.VectorTransform = None) -> faiss.Index:
+    if transform is None:
+        index = faiss.index_factory(dim, index_type, faiss.METRIC_INNER_PRODUCT)
+    else:
+        inner = faiss.index_factory(transform.d_out, index_type, faiss.METRIC_INNER_PRODUCT)
+        index = faiss.IndexPreTransform(transform, inner)
+    if is_id_mapped(index):
+        return index
+    return faiss.IndexIDMap2(index)
+
+
+def is_id_mapped(index: faiss.Index) -> bool:
+    """IVF indexes keep the ids of their inverted lists, others need an IDMap."""
+    if isinstance(faiss.downcast_index(index), faiss.IndexIDMap):
+        return True
+    try:
+        faiss.extract_index_ivf(index)
+        return True
+    except RuntimeError:
+        return False
+
+
+def intern_ids(ids: List[str]) -> np.ndarray:
+    table = np.empty(len(ids), dtype=object)
+    table[:] = [sys.intern(str(i)) for i in ids]
+    return table
+
+
+def find_hnsw(index: faiss.Index):
+    index = faiss.downcast_index(index)
+    while not hasattr(index, "hnsw"):
+        if isinstance(index, (faiss.IndexPreTransform, faiss.IndexIDMap)):
+            index = faiss.downcast_index(index.index)
+        elif isinstance(index, faiss.IndexRefine):
+            index = faiss.downcast_index(index.base_index)
+        else:
+            return None
+    return index
+
+
+def choose_index_type(num_vectors: int, dim: int, memory_budget_gb: float = None) -> str:
+    """
+    Flat for small corpora, HNSW while float32 vectors plus graph links fit
+    the memory budget, otherwise IVF with the finest codes that fit.
+    """
+    budget = float("inf") if memory_budget_gb is None else memory_budget_gb * 1024**3
+    flat_bytes = num_vectors * dim * 4
+    if num_vectors <= 200_000 and flat_bytes <= budget:
+        return "Flat"
+    if flat_bytes + num_vectors * 32 * 2 * 4 <= budget:
+        return "HNSW32"
+    nlist = 1 << int(np.clip(np.log2(4 * np.sqrt(num_vectors)), 6, 16))
+    if flat_bytes <= budget:
+        return f"IVF{nlist},Flat"
+    if num_vectors * dim <= budget:
+        return f"IVF{nlist},SQ8"
+    for m in (64, 48, 32, 16, 8):
+        if dim % m == 0 and num_vectors * (m + 8) <= budget:
+            return f"IVF{nlist},PQ{m}"
+    return f"IVF{nlist},PQ8"
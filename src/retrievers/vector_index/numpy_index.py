@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Literal, Set, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from .base import BaseIndex
+from .faiss_index import intern_ids
+from .shards import EMBEDDING_SUFFIX, load_shard
+
+MatrixDtype = Literal["float32", "float16"]
+
+
+class NumpyIndex(BaseIndex):
+    """
+    Exact inner product search without faiss. The passage matrix is kept as
+    the memory mapped .npy shards, or copied to memory as float32 or float16.
+    A query block is scored against a block of passage rows with one matrix
+    multiply and the top-k is taken with np.argpartition, query blocks run on
+    a thread pool since BLAS releases the GIL. Nothing is trained or saved.
+    """
+
+    def __init__(
+        self,
+        dim: int = 768,
+        dtype: MatrixDtype = "float32",
+        in_memory: bool = False,
+        query_block_size: int = 256,
+        row_block_size: int = 16384,
+        num_threads: int = 4,
+    ):
+        super().__init__()
+        self.dim = dim
+        self.dtype = dtype
+        self.in_memory = in_memory
+        self.query_block_size = query_block_size
+        self.row_block_size = row_block_size
+        self.blocks = []
+        self.id_table = np.zeros(0, dtype=object)
+        self.pool = ThreadPoolExecutor(max_workers=num_threads)
+
+    def load_data(self, passage_embeddings: List[str], memmap_path: str = None):
+        ids = []
+        for fpath in tqdm(passage_embeddings, desc="Load embeddings"):
+            cur_ids, embeddings = load_shard(fpath)
+            ids.extend(cur_ids)
+            mapped = fpath.endswith(EMBEDDING_SUFFIX) and embeddings.dtype == np.dtype(self.dtype)
+            if self.in_memory or not mapped:
+                embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+            self.blocks.append(embeddings)
+        self.id_table = intern_ids(ids)
+        print(f"Total data indexed {len(self.id_table)}")
+
+    def search(
+        self,
+        query_vectors: np.array,
+        top_k: int = 20,
+        exclude_ids: List[Set[str]] = None,
+        search_params=None,
+    ) -> List[Tuple[List[object], List[float]]]:
+        query_vectors = np.ascontiguousarray(query_vectors, dtype="float32")
+        fetch_k = top_k
+        if exclude_ids is not None:
+            fetch_k += max((len(ids) for ids in exclude_ids), default=0)
+        fetch_k = min(fetch_k, len(self.id_table))
+        starts = range(0, len(query_vectors), self.query_block_size)
+        blocks = list(
+            self.pool.map(
+                lambda start: self.search_block(query_vectors[start : start + self.query_block_size], fetch_k),
+                starts,
+            )
+        )
+        scores = np.concatenate([block_scores for block_scores, _ in blocks]) if len(starts) else []
+        rows = np.concatenate([block_rows for _, block_rows in blocks]) if len(starts) else []
+
+        result = []
+        for i in range(len(query_vectors)):
+            db_ids = self.id_table[rows[i]].tolist()
+            if exclude_ids is None:
+                result.append((db_ids, scores[i]))
+                continue
+            keep = [j for j, db_id in enumerate(db_ids) if db_id not in exclude_ids[i]][:top_k]
+            result.append(([db_ids[j] for j in keep], scores[i][keep]))
+        return result
+
+    def search_block(self, queries: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Keep the running top_k over all passage row blocks, sorted by score."""
+        best_scores = np.full((len(queries), 0), -np.inf, dtype="float32")
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        offset = 0
+        for block in self.blocks:
+            for start in range(0, len(block), self.row_block_size):
+                rows = block[start : start + self.row_block_size]
+                scores = queries @ np.asarray(rows, dtype="float32").T
+                k = min(top_k, scores.shape[1])
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+                best_rows = np.concatenate([best_rows, top + offset + start], axis=1)
+                if best_scores.shape[1] > top_k:
+                    top = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                    best_scores = np.take_along_axis(best_scores, top, axis=1)
+                    best_rows = np.take_along_axis(best_rows, top, axis=1)
+            offset += len(block)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def serialize(self, dir_path):
+        # the shards are the index
+        pass
+
+    def deserialize(self, dir_path):
+        # exist_index is always False, so the index is never loaded from dir_path
+        raise ValueError(
+            f"NumpyIndex has no saved index in {dir_path}, it is rebuilt from the embedding shards with load_data"
+        )
+
+    def exist_index(self, dir_path):
+        return False
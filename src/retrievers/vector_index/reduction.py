@@ -0,0 +1,75 @@
+import os
+from typing import Dict, Literal, Tuple
+
+import faiss
+import numpy as np
+
+from .shards import read_manifest
+
+ReductionMethod = Literal["pca", "opq"]
+REDUCTION_FNAME = "reduction.faiss"
+
+
+def learn_reduction(vectors: np.ndarray, out_dim: int, method: ReductionMethod = "pca") -> faiss.VectorTransform:
+    """
+    Learn a rotation to out_dim dimensions on a sample of vectors. The PCA
+    mean is not subtracted when applying it, so inner products are projected
+    onto the principal subspace instead of being shifted per passage.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    in_dim = vectors.shape[1]
+    if method == "pca":
+        transform = faiss.PCAMatrix(in_dim, out_dim)
+        transform.train(vectors)
+        faiss.copy_array_to_vector(np.zeros(out_dim, dtype="float32"), transform.b)
+        return transform
+    num_subquantizers = next(m for m in (64, 48, 32, 16, 8, 4, 2, 1) if out_dim % m == 0)
+    transform = faiss.OPQMatrix(in_dim, num_subquantizers, out_dim)
+    transform.train(vectors)
+    return transform
+
+
+def apply_reduction(transform: faiss.VectorTransform, vectors: np.ndarray) -> np.ndarray:
+    return transform.apply(np.ascontiguousarray(vectors, dtype="float32"))
+
+
+def reduction_recall(
+    transform: faiss.VectorTransform,
+    vectors: np.ndarray,
+    ks: Tuple[int, ...] = (1, 5, 10, 20),
+    num_queries: int = 1000,
+) -> Dict[int, float]:
+    """
+    Recall@k of exact inner product search on the reduced vectors against
+    the full dimension, the first num_queries vectors query the rest.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    num_queries = min(num_queries, len(vectors) // 10)
+    queries, database = vectors[:num_queries], vectors[num_queries:]
+    top_k = max(ks)
+    full = faiss.IndexFlatIP(vectors.shape[1])
+    full.add(database)
+    _, truth = full.search(queries, top_k)
+    reduced = faiss.IndexFlatIP(transform.d_out)
+    reduced.add(apply_reduction(transform, database))
+    _, found = reduced.search(apply_reduction(transform, queries), top_k)
+    return {
+        k: float(np.mean([len(set(t[:k]) & set(f[:k])) / k for t, f in zip(truth, found)]))
+        for k in ks
+    }
+
+
+def format_recall(recall: Dict[int, float]) -> str:
+    return ", ".join(f"recall@{k} {value:.4f}" for k, value in recall.items())
+
+
+def save_reduction(transform: faiss.VectorTransform, dir_path: str):
+    faiss.write_VectorTransform(transform, os.path.join(dir_path, REDUCTION_FNAME))
+
+
+def load_reduction(embedding_dir: str) -> faiss.VectorTransform:
+    """The transform passage_embedder stored the shards with, None for full dimension shards."""
+    manifest = read_manifest(embedding_dir)
+    if manifest is None or manifest.get("reduction") is None:
+        return None
+    return faiss.read_VectorTransform(os.path.join(embedding_dir, manifest["reduction"]["fname"]))
@@ -0,0 +1,117 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Set, Tuple
+
+import numpy as np
+
+from .base import BaseIndex
+from .faiss_index import FaissIndex, SearchParams
+from .shards import shard_shape
+
+
+class ShardedFaissIndex(BaseIndex):
+    """
+    Several FaissIndex shards, each built from a contiguous group of the
+    passages_XX files. Query batches are searched on every shard from a
+    thread pool, faiss releases the GIL while searching, and the per shard
+    top-k lists are merged by score.
+    """
+
+    def __init__(self, num_shards: int = 2, num_threads: int = None, **index_kwargs):
+        super().__init__()
+        self.shards_fname = "shards.json"
+        self.num_shards = num_shards
+        self.shards = [FaissIndex(**index_kwargs) for _ in range(num_shards)]
+        self.rerank_k = index_kwargs.get("rerank_k")
+        self.pool = ThreadPoolExecutor(max_workers=num_threads or num_shards)
+
+    def search(
+        self,
+        query_vectors: np.array,
+        top_k: int = 20,
+        exclude_ids: List[Set[str]] = None,
+        search_params: SearchParams = None,
+    ) -> List[Tuple[List[object], List[float]]]:
+        shard_results = list(
+            self.pool.map(
+                lambda shard: shard.search(query_vectors, top_k, exclude_ids, search_params),
+                self.shards,
+            )
+        )
+        result = []
+        for per_shard in zip(*shard_results):
+            ids = [db_id for db_ids, _ in per_shard for db_id in db_ids]
+            scores = np.concatenate([np.asarray(shard_scores, dtype="float32") for _, shard_scores in per_shard])
+            order = np.argsort(-scores, kind="stable")[:top_k]
+            result.append(([ids[j] for j in order], scores[order]))
+        return result
+
+    def group_files(self, passage_embeddings: List[str]) -> List[List[str]]:
+        """Split the shard files, which hold chunk_size passages each, into num_shards contiguous groups."""
+        if len(passage_embeddings) < self.num_shards:
+            raise ValueError(f"{len(passage_embeddings)} embedding files can not fill {self.num_shards} index shards")
+        return [group.tolist() for group in np.array_split(np.array(passage_embeddings), self.num_shards)]
+
+    def load_data(self, passage_embeddings: List[str], memmap_path: str = None):
+        for idx, (shard, files) in enumerate(zip(self.shards, self.group_files(passage_embeddings))):
+            print(f"Building index shard {idx} from {len(files)} files")
+            shard.load_data(files, None if memmap_path is None else f"{memmap_path}.{idx}")
+
+    def attach_rerank_vectors(self, passage_embeddings: List[str], dir_path: str):
+        for idx, (shard, files) in enumerate(zip(self.shards, self.group_files(passage_embeddings))):
+            shard.attach_rerank_vectors(files, self.shard_dir(dir_path, idx))
+
+    def upsert(self, ids: List[str], embeddings: np.ndarray, fpath: str = None):
+        """New rows go to the last shard, which holds the last files, so live_mask follows the files."""
+        for shard in self.shards[:-1]:
+            shard.delete(ids)
+        self.shards[-1].upsert(ids, embeddings, fpath)
+
+    def check_upsert(self, ids: List[str]):
+        self.shards[-1].check_upsert(ids)
+
+    def delete(self, ids: List[str]) -> int:
+        return sum(shard.delete(ids) for shard in self.shards)
+
+    def live_mask(self) -> np.ndarray:
+        return np.concatenate([shard.live_mask() for shard in self.shards])
+
+    def live_ids(self) -> Set[str]:
+        return set().union(*(shard.live_ids() for shard in self.shards))
+
+    def rebuild(self, passage_embeddings: List[str]):
+        # compaction rewrites files one for one, so the shards take their live rows back in order
+        files = iter(passage_embeddings)
+        for shard in self.shards:
+            remaining = int(shard.live_mask().sum())
+            shard_files = []
+            while remaining > 0:
+                fpath = next(files)
+                shard_files.append(fpath)
+                remaining -= shard_shape(fpath)[0]
+            shard.rebuild(shard_files)
+
+    def shard_dir(self, dir_path: str, idx: int) -> str:
+        return os.path.join(dir_path, f"shard_{idx:02d}")
+
+    def serialize(self, dir_path):
+        for idx, shard in enumerate(self.shards):
+            shard.serialize(self.shard_dir(dir_path, idx))
+        with open(os.path.join(dir_path, self.shards_fname), "w", encoding="utf-8") as f:
+            json.dump({"num_shards": self.num_shards}, f)
+
+    def deserialize(self, dir_path):
+        for idx, shard in enumerate(self.shards):
+            shard.deserialize(self.shard_dir(dir_path, idx))
+
+    def exist_index(self, dir_path):
+        shards_file = os.path.join(dir_path, self.shards_fname)
+        if not os.path.exists(shards_file):
+            return False
+        with open(shards_file, "r", encoding="utf-8") as f:
+            num_shards = json.load(f)["num_shards"]
+        if num_shards != self.num_shards:
+            print(f"Index in {dir_path} has {num_shards} shards, expected {self.num_shards}")
+            return False
+        return all(shard.exist_index(self.shard_dir(dir_path, idx)) for idx, shard in enumerate(self.shards))
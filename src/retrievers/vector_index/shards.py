@@ -0,0 +1,198 @@
+import json
+import os
+import pickle
+from glob import glob
+from typing import List, Tuple
+
+import numpy as np
+
+MANIFEST_FNAME = "manifest.json"
+EMBEDDING_SUFFIX = ".npy"
+IDS_SUFFIX = ".ids"
+
+
+def shard_name(idx: int) -> str:
+    return f"passages_{idx:02d}"
+
+
+def write_shard(output_dir: str, idx: int, ids: List[str], embeddings: np.ndarray) -> dict:
+    """
+    Store a shard as a raw .npy matrix that can be memory mapped, and its
+    passage ids one per line in a .ids file.
+    """
+    name = shard_name(idx)
+    np.save(os.path.join(output_dir, name + EMBEDDING_SUFFIX), np.ascontiguousarray(embeddings))
+    with open(os.path.join(output_dir, name + IDS_SUFFIX), "w", encoding="utf-8") as f:
+        f.write("\n".join(str(i) for i in ids))
+    return {"name": name, "count": len(ids)}
+
+
+def write_pickle_shard(output_dir: str, idx: int, ids: List[str], embeddings: np.ndarray) -> dict:
+    name = shard_name(idx)
+    with open(os.path.join(output_dir, name), "wb") as f:
+        pickle.dump((ids, embeddings), f)
+    return {"name": name, "count": len(ids)}
+
+
+def write_manifest(
+    output_dir: str, model_type: str, dim: int, dtype: str, shards: List[dict], reduction: dict = None
+):
+    """reduction describes the transform the shards were reduced with, if any."""
+    manifest = {
+        "model_type": model_type,
+        "dim": dim,
+        "dtype": dtype,
+        "count": sum(shard["count"] for shard in shards),
+        "shards": shards,
+    }
+    if reduction is not None:
+        manifest["reduction"] = reduction
+    with open(os.path.join(output_dir, MANIFEST_FNAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest(embedding_dir: str) -> dict:
+    manifest_file = os.path.join(embedding_dir, MANIFEST_FNAME)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_shards(embedding_dir: str) -> List[str]:
+    """Shard files of an embedding dir, .npy shards from the manifest or legacy pickles."""
+    manifest = read_manifest(embedding_dir)
+    if manifest is not None:
+        return [
+            os.path.join(embedding_dir, shard["name"] + EMBEDDING_SUFFIX)
+            for shard in manifest["shards"]
+        ]
+    return sorted(
+        fpath
+        for fpath in glob(os.path.join(embedding_dir, "passage*"))
+        if not fpath.endswith((EMBEDDING_SUFFIX, IDS_SUFFIX))
+    )
+
+
+def load_ids(fpath: str) -> List[str]:
+    with open(fpath[: -len(EMBEDDING_SUFFIX)] + IDS_SUFFIX, "r", encoding="utf-8") as f:
+        content = f.read()
+    return content.split("\n") if content else []
+
+
+def load_shard(fpath: str) -> Tuple[List[str], np.ndarray]:
+    """.npy shards are memory mapped, legacy shards are unpickled."""
+    if fpath.endswith(EMBEDDING_SUFFIX):
+        return load_ids(fpath), np.load(fpath, mmap_mode="r")
+    with open(fpath, "rb") as fin:
+        ids, embeddings = pickle.load(fin)
+    return ids, embeddings
+
+
+def shard_shape(fpath: str) -> Tuple[int, int]:
+    if fpath.endswith(EMBEDDING_SUFFIX):
+        return np.load(fpath, mmap_mode="r").shape
+    # pickled shards have no header, the shard is read once to get its shape
+    _, embeddings = load_shard(fpath)
+    return embeddings.shape
+
+
+def gather_rows(blocks: List[np.ndarray], offsets: np.ndarray, rows: np.ndarray, dim: int) -> np.ndarray:
+    """float32 vectors of sorted global rows, read block by block, offsets holds the first row of each block."""
+    shard_idx = np.searchsorted(offsets, rows, side="right") - 1
+    vectors = np.empty((len(rows), dim), dtype="float32")
+    for idx in np.unique(shard_idx):
+        mask = shard_idx == idx
+        vectors[mask] = blocks[idx][rows[mask] - offsets[idx]]
+    return vectors
+
+
+def check_shards(embedding_dir: str) -> List[str]:
+    """Compare every shard header and id file with the manifest without reading the vectors."""
+    manifest = read_manifest(embedding_dir)
+    if manifest is None:
+        return [f"No {MANIFEST_FNAME} in {embedding_dir}"]
+    problems = []
+    for shard in manifest["shards"]:
+        fpath = os.path.join(embedding_dir, shard["name"] + EMBEDDING_SUFFIX)
+        if not os.path.exists(fpath):
+            problems.append(f"{fpath} is missing")
+            continue
+        embeddings = np.load(fpath, mmap_mode="r")
+        if embeddings.shape != (shard["count"], manifest["dim"]):
+            problems.append(f"{fpath} has shape {embeddings.shape}, expected {(shard['count'], manifest['dim'])}")
+        if str(embeddings.dtype) != manifest["dtype"]:
+            problems.append(f"{fpath} has dtype {embeddings.dtype}, expected {manifest['dtype']}")
+        ids_count = len(load_ids(fpath))
+        if ids_count != shard["count"]:
+            problems.append(f"{fpath} has {ids_count} ids, expected {shard['count']}")
+    return problems
+
+
+def next_shard_idx(manifest: dict) -> int:
+    return max((int(shard["name"].rsplit("_", 1)[1]) for shard in manifest["shards"]), default=-1) + 1
+
+
+def append_shard(embedding_dir: str, ids: List[str], embeddings: np.ndarray) -> str:
+    """Write upserted vectors as a new shard at the end of the manifest, rows keep their positions."""
+    manifest = read_manifest(embedding_dir)
+    if manifest is None:
+        raise ValueError(f"No {MANIFEST_FNAME} in {embedding_dir}, updates need npy shards")
+    shard = write_shard(embedding_dir, next_shard_idx(manifest), ids, embeddings.astype(manifest["dtype"]))
+    manifest["shards"].append(shard)
+    write_manifest(
+        embedding_dir,
+        manifest["model_type"],
+        manifest["dim"],
+        manifest["dtype"],
+        manifest["shards"],
+        manifest.get("reduction"),
+    )
+    return os.path.join(embedding_dir, shard["name"] + EMBEDDING_SUFFIX)
+
+
+def compact_shards(embedding_dir: str, keep: np.ndarray, batch_size: int = 100_000) -> List[str]:
+    """
+    Rewrite the shards holding rows where keep is False, in place in the
+    manifest so the remaining rows keep their order, and drop the old files.
+    """
+    manifest = read_manifest(embedding_dir)
+    if manifest is None:
+        raise ValueError(f"No {MANIFEST_FNAME} in {embedding_dir}, compaction needs npy shards")
+    assert len(keep) == manifest["count"], "Compaction mask should cover every shard row"
+    idx = next_shard_idx(manifest)
+    shards, stale_files = [], []
+    offset = 0
+    for shard in manifest["shards"]:
+        mask = keep[offset : offset + shard["count"]]
+        offset += shard["count"]
+        if mask.all():
+            shards.append(shard)
+            continue
+        fpath = os.path.join(embedding_dir, shard["name"] + EMBEDDING_SUFFIX)
+        stale_files.extend([fpath, fpath[: -len(EMBEDDING_SUFFIX)] + IDS_SUFFIX])
+        if not mask.any():
+            continue
+        ids, embeddings = load_shard(fpath)
+        rows = np.flatnonzero(mask)
+        name = shard_name(idx)
+        idx += 1
+        out = np.lib.format.open_memmap(
+            os.path.join(embedding_dir, name + EMBEDDING_SUFFIX),
+            mode="w+",
+            dtype=embeddings.dtype,
+            shape=(len(rows), embeddings.shape[1]),
+        )
+        for start in range(0, len(rows), batch_size):
+            out[start : start + batch_size] = embeddings[rows[start : start + batch_size]]
+        out.flush()
+        del out
+        with open(os.path.join(embedding_dir, name + IDS_SUFFIX), "w", encoding="utf-8") as f:
+            f.write("\n".join(ids[row] for row in rows))
+        shards.append({"name": name, "count": len(rows)})
+    write_manifest(
+        embedding_dir, manifest["model_type"], manifest["dim"], manifest["dtype"], shards, manifest.get("reduction")
+    )
+    for fpath in stale_files:
+        os.remove(fpath)
+    return list_shards(embedding_dir)